@@ -0,0 +1,95 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, FloatField, Sum, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from books.models import Book
+from .models import BookDailyViews, BookRanking
+
+# Number of books kept in each leaderboard
+LEADERBOARD_SIZE = getattr(settings, "LEADERBOARD_SIZE", 100)
+# Number of average ratings a book's ratings are weighted against
+RATING_PRIOR_WEIGHT = getattr(settings, "LEADERBOARD_RATING_PRIOR_WEIGHT", 10)
+
+
+def getBoardStart(board: str, today):
+    # First day counted by a leaderboard, None for all time
+    if board == BookRanking.Board.LAST_7_DAYS:
+        return today - timedelta(days=6)
+    if board == BookRanking.Board.LAST_30_DAYS:
+        return today - timedelta(days=29)
+    if board == BookRanking.Board.MONTH:
+        return today.replace(day=1)
+    return None
+
+
+def rankReads(board: str, today, size: int) -> list:
+    views = BookDailyViews.objects.all()
+    start = getBoardStart(board, today)
+    if start is not None:
+        views = views.filter(day__gte=start, day__lte=today)
+    rows = (
+        views.order_by()
+        .values("book")
+        .annotate(reads=Sum("reads"))
+        .order_by("-reads", "book")[:size]
+    )
+    return [(row["book"], row["reads"], row["reads"]) for row in rows]
+
+
+def rankRatings(size: int) -> list:
+    """
+    Rank the books by their Bayesian average rating.
+
+    Every book gets RATING_PRIOR_WEIGHT extra ratings equal to the average of
+    all ratings, so a book with a couple of 5 star ratings ranks below a book
+    with hundreds of mostly 5 star ones.
+    """
+    totals = Book.objects.aggregate(sum=Sum("rating_sum"), count=Sum("rating_count"))
+    if not totals["count"]:
+        return []
+    mean = totals["sum"] / totals["count"]
+    rows = (
+        Book.objects.filter(rating_count__gt=0)
+        .annotate(
+            score=(
+                Value(RATING_PRIOR_WEIGHT * mean, output_field=FloatField())
+                + Cast("rating_sum", FloatField())
+            )
+            / (Value(RATING_PRIOR_WEIGHT, output_field=FloatField()) + F("rating_count"))
+        )
+        .order_by("-score", "-rating_count", "id")
+        .values_list("id", "score", "rating_count")[:size]
+    )
+    return list(rows)
+
+
+def refreshLeaderboards(size: int = LEADERBOARD_SIZE) -> int:
+    # Recompute every leaderboard, returns the number of rankings stored
+    today = timezone.localdate()
+    boards = {
+        (board, BookRanking.Metric.READS): rankReads(board, today, size)
+        for board in BookRanking.Board.values
+    }
+    # Ratings are not dated, so they are only ranked all time
+    boards[BookRanking.Board.ALL_TIME, BookRanking.Metric.RATING] = rankRatings(size)
+
+    rankings = [
+        BookRanking(
+            board=board,
+            metric=metric,
+            rank=rank,
+            book_id=book_id,
+            score=score,
+            count=count,
+        )
+        for (board, metric), rows in boards.items()
+        for rank, (book_id, score, count) in enumerate(rows, start=1)
+    ]
+    # Replaced in one transaction so readers never see a partial leaderboard
+    with transaction.atomic():
+        BookRanking.objects.all().delete()
+        BookRanking.objects.bulk_create(rankings)
+    return len(rankings)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from TLLAdmin.rollups import refreshDailyViews
+
+
+class Command(BaseCommand):
+    help = "Recount the daily views of the books read since the last refresh"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="Number of ReadBook ids processed per query",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Drop the rollup and rebuild it from every ReadBook row",
+        )
+
+    def handle(self, *args, **options):
+        processed = refreshDailyViews(options["batch_size"], options["rebuild"])
+        self.stdout.write(self.style.SUCCESS(f"Recounted the days of {processed} reads"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from TLLAdmin.leaderboards import LEADERBOARD_SIZE, refreshLeaderboards
+from TLLAdmin.rollups import refreshDailyViews
+
+
+class Command(BaseCommand):
+    help = "Recompute the most read and best rated books leaderboards"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=LEADERBOARD_SIZE,
+            help="Number of books kept in each leaderboard",
+        )
+
+    def handle(self, *args, **options):
+        # The reads leaderboards are ranked from the daily views rollup
+        refreshDailyViews()
+        count = refreshLeaderboards(options["size"])
+        self.stdout.write(self.style.SUCCESS(f"Stored {count} rankings"))
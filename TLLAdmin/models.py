@@ -1,3 +1,58 @@
 from django.db import models
+from books.models import Book
 
 # Create your models here.
+
+
+class BookDailyViews(models.Model):
+    # Number of first reads of a book per day, see refresh_daily_views
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="daily_views")
+    day = models.DateField()
+    reads = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["book", "day"], name="unique_book_day")
+        ]
+        indexes = [models.Index(fields=["day", "book"])]
+
+
+class RollupWatermark(models.Model):
+    # Id of the last row of the source table that can no longer be committed late
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    # Highest id seen at pending_since, becomes last_id once the lag has passed
+    pending_id = models.BigIntegerField(default=0)
+    pending_since = models.DateTimeField(blank=True, null=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+
+class BookRanking(models.Model):
+    # Precomputed leaderboard positions, see refresh_leaderboards
+    class Board(models.TextChoices):
+        ALL_TIME = "all-time"
+        LAST_7_DAYS = "7-days"
+        LAST_30_DAYS = "30-days"
+        MONTH = "month"
+
+    class Metric(models.TextChoices):
+        READS = "reads"
+        RATING = "rating"
+
+    board = models.CharField(max_length=10, choices=Board.choices)
+    metric = models.CharField(max_length=10, choices=Metric.choices)
+    rank = models.IntegerField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="rankings")
+    # Number of reads, or Bayesian average rating
+    score = models.FloatField()
+    # Number of reads, or of ratings
+    count = models.IntegerField()
+    date_computed = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["board", "metric", "rank"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["board", "metric", "rank"], name="unique_board_rank"
+            )
+        ]
@@ -0,0 +1,172 @@
+from datetime import date, datetime, time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DateField, Max, Q, Sum
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+
+from books.models import ReadBook
+from .models import BookDailyViews, RollupWatermark
+
+DAILY_VIEWS = "book_daily_views"
+# Seconds within which a ReadBook row may commit after rows with higher ids
+ROLLUP_LAG = getattr(settings, "ROLLUP_LAG_SECONDS", 10 * 60)
+
+SERIES_INTERVALS = ("day", "week", "month")
+
+
+def recountDailyViews(reads) -> int:
+    """
+    Recount the daily views of the books and days of a queryset of ReadBook rows.
+
+    The views of those days are counted again from every ReadBook row rather
+    than added to, so counting the same rows twice gives the same totals.
+    Each book is only recounted over the days its rows fall on, with
+    read_date ranges that the (book, read_date) index answers. Returns the
+    number of rows in the queryset.
+    """
+    rows = {
+        (row["book"], row["day"]): row["reads"]
+        for row in reads.annotate(day=TruncDate("read_date"))
+        .order_by()
+        .values("book", "day")
+        .annotate(reads=Count("id"))
+    }
+    if not rows:
+        return 0
+
+    books_by_day = {}
+    for book, day in rows:
+        books_by_day.setdefault(day, set()).add(book)
+    ranges = Q()
+    for day, books in books_by_day.items():
+        # TruncDate uses the current time zone, so do the day boundaries
+        ranges |= Q(
+            book_id__in=books,
+            read_date__gte=timezone.make_aware(datetime.combine(day, time.min)),
+            read_date__lt=timezone.make_aware(
+                datetime.combine(day + timedelta(days=1), time.min)
+            ),
+        )
+    counts = {
+        (row["book"], row["day"]): row["reads"]
+        for row in ReadBook.objects.filter(ranges)
+        .annotate(day=TruncDate("read_date"))
+        .order_by()
+        .values("book", "day")
+        .annotate(reads=Count("id"))
+    }
+
+    BookDailyViews.objects.bulk_create(
+        [
+            BookDailyViews(book_id=book, day=day, reads=counts.get((book, day), 0))
+            for book, day in rows
+        ],
+        update_conflicts=True,
+        unique_fields=["book", "day"],
+        update_fields=["reads"],
+    )
+    return sum(rows.values())
+
+
+def refreshDailyViews(batch_size: int = 10000, rebuild: bool = False) -> int:
+    """
+    Recount the days of the ReadBook rows created since the last refresh.
+
+    Ids are not committed in order (the read buffers of several processes
+    insert at the same time), so the rows above the watermark are recounted
+    on every refresh until ROLLUP_LAG seconds after a refresh first saw them.
+    They are read in batches of `batch_size` ids, and the watermark row is
+    locked so concurrent refreshes run one at a time. Returns the number of
+    ReadBook rows processed.
+    """
+    processed = 0
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(
+            name=DAILY_VIEWS
+        )
+        if rebuild:
+            BookDailyViews.objects.all().delete()
+            watermark.last_id = watermark.pending_id = 0
+            watermark.pending_since = None
+
+        last_id = ReadBook.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        now = timezone.now()
+        # The rows up to pending_id have had the lag to commit, stop recounting them
+        if watermark.pending_since is None or now - watermark.pending_since >= timedelta(
+            seconds=ROLLUP_LAG
+        ):
+            watermark.last_id = watermark.pending_id
+            watermark.pending_id = last_id
+            watermark.pending_since = now
+
+        start = watermark.last_id
+        while start < last_id:
+            end = min(start + batch_size, last_id)
+            reads = ReadBook.objects.filter(id__gt=start, id__lte=end)
+            processed += recountDailyViews(reads)
+            start = end
+        watermark.save()
+    return processed
+
+
+def truncateDate(day: date, interval: str) -> date:
+    # Start of the day, week (Monday) or month a date falls in, like Trunc
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    if interval == "month":
+        return day.replace(day=1)
+    return day
+
+
+def nextPeriod(day: date, interval: str) -> date:
+    if interval == "week":
+        return day + timedelta(weeks=1)
+    if interval == "month":
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def countPeriods(start: date, end: date, interval: str) -> int:
+    # Number of periods getPeriods returns, without building them
+    if interval == "month":
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    days = (truncateDate(end, interval) - truncateDate(start, interval)).days
+    return days // 7 + 1 if interval == "week" else days + 1
+
+
+def getPeriods(start: date, end: date, interval: str) -> list:
+    # Every period between start and end, both included
+    periods = []
+    period = truncateDate(start, interval)
+    while period <= end:
+        periods.append(period)
+        try:
+            period = nextPeriod(period, interval)
+        except OverflowError:
+            # The period after the one holding date.max
+            break
+    return periods
+
+
+def getViewsSeries(start: date, end: date, interval: str, book_ids=None) -> list:
+    """
+    Get the views from start to end bucketed by day, week or month.
+
+    The buckets are summed by one grouped query over the daily rollup, and
+    periods without views are filled in with 0.
+    """
+    views = BookDailyViews.objects.filter(day__gte=start, day__lte=end)
+    if book_ids:
+        views = views.filter(book_id__in=book_ids)
+    counts = dict(
+        views.annotate(period=Trunc("day", interval, output_field=DateField()))
+        .order_by()
+        .values("period")
+        .annotate(views=Sum("reads"))
+        .values_list("period", "views")
+    )
+    return [
+        {"period": period, "views": counts.get(period, 0)}
+        for period in getPeriods(start, end, interval)
+    ]
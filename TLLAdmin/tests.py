@@ -1,3 +1,276 @@
+from datetime import date, datetime, timedelta, timezone
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone as django_timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from books.models import Book, Rating, ReadBook
+from .models import BookDailyViews, RollupWatermark
+from .rollups import DAILY_VIEWS, countPeriods
 
 # Create your tests here.
+
+
+class DailyViewsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = User.objects.create_user(
+            username="adminuser", password="adminpassword", is_staff=True
+        )
+        self.client.force_authenticate(user=self.admin_user)
+        self.book = Book.objects.create(title="Book", published_by=self.admin_user)
+        self.other_book = Book.objects.create(title="Other", published_by=self.admin_user)
+        self.readers = [
+            User.objects.create_user(username=f"reader{i}", password="password")
+            for i in range(3)
+        ]
+
+    def read(self, user, book, *date):
+        ReadBook.objects.create(
+            user=user, book=book, read_date=datetime(*date, tzinfo=timezone.utc)
+        )
+
+    def refresh(self, *args):
+        call_command("refresh_daily_views", *args, stdout=StringIO())
+
+    def test_refresh_is_incremental(self):
+        self.read(self.readers[0], self.book, 2023, 5, 1, 10)
+        self.read(self.readers[1], self.book, 2023, 5, 1, 20)
+        self.read(self.readers[0], self.other_book, 2023, 6, 2)
+        self.refresh("--batch-size", "2")
+        self.assertEqual(
+            BookDailyViews.objects.get(book=self.book, day="2023-05-01").reads, 2
+        )
+        self.assertEqual(
+            RollupWatermark.objects.get(name=DAILY_VIEWS).pending_id,
+            ReadBook.objects.latest("id").id,
+        )
+
+        # Rows seen again are recounted, not added twice
+        self.read(self.readers[2], self.book, 2023, 5, 1, 23)
+        self.refresh()
+        self.refresh()
+        self.assertEqual(
+            BookDailyViews.objects.get(book=self.book, day="2023-05-01").reads, 3
+        )
+        self.assertEqual(BookDailyViews.objects.count(), 2)
+
+        self.refresh("--rebuild")
+        self.assertEqual(
+            BookDailyViews.objects.get(book=self.book, day="2023-05-01").reads, 3
+        )
+
+    def test_rows_committed_late_are_counted(self):
+        self.read(self.readers[0], self.book, 2023, 5, 1)
+        late = ReadBook.objects.create(
+            user=self.readers[1], book=self.book, read_date=django_timezone.now()
+        )
+        self.read(self.readers[2], self.book, 2023, 5, 1)
+        # A row with a lower id that was not committed yet during the refresh
+        late_id = late.id
+        late.delete()
+        self.refresh()
+        self.assertEqual(
+            BookDailyViews.objects.get(book=self.book, day="2023-05-01").reads, 2
+        )
+        ReadBook.objects.create(
+            id=late_id,
+            user=self.readers[1],
+            book=self.book,
+            read_date=datetime(2023, 5, 1, tzinfo=timezone.utc),
+        )
+        self.refresh()
+        self.assertEqual(
+            BookDailyViews.objects.get(book=self.book, day="2023-05-01").reads, 3
+        )
+
+        # Once the lag has passed the rows are no longer read
+        RollupWatermark.objects.filter(name=DAILY_VIEWS).update(
+            pending_since=django_timezone.now() - timedelta(hours=1)
+        )
+        self.refresh()
+        watermark = RollupWatermark.objects.get(name=DAILY_VIEWS)
+        self.assertEqual(watermark.last_id, ReadBook.objects.latest("id").id)
+        self.assertEqual(
+            BookDailyViews.objects.get(book=self.book, day="2023-05-01").reads, 3
+        )
+
+    def test_views_endpoints(self):
+        self.read(self.readers[0], self.book, 2023, 5, 1)
+        self.read(self.readers[1], self.book, 2023, 6, 1)
+        self.read(self.readers[0], self.other_book, 2023, 5, 3)
+        self.read(self.readers[2], self.other_book, 2022, 5, 3)
+        self.refresh()
+
+        response = self.client.get(reverse("admin-views"))
+        self.assertEqual(response.data["views"], 4)
+
+        response = self.client.get(reverse("admin-views-book", args=[self.book.id]))
+        self.assertEqual(response.data["views"], 2)
+
+        response = self.client.get(reverse("admin-views-year", args=[2023]))
+        self.assertEqual(response.data["number of books read"], 2)
+        self.assertEqual(response.data["views"], 3)
+
+        response = self.client.get(
+            reverse("admin-views-year-book", args=[2023, self.other_book.id])
+        )
+        self.assertEqual(response.data["views"], 1)
+
+        response = self.client.get(reverse("admin-views-month", args=[2023, 5]))
+        self.assertEqual(response.data["number of books read"], 2)
+        self.assertEqual(response.data["views"], 2)
+
+        response = self.client.get(
+            reverse("admin-views-month-book", args=[2023, 6, self.book.id])
+        )
+        self.assertEqual(response.data["views"], 1)
+
+        response = self.client.get(reverse("admin-views-book", args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_views_series(self):
+        self.read(self.readers[0], self.book, 2023, 1, 30)
+        self.read(self.readers[1], self.book, 2023, 3, 2)
+        self.read(self.readers[0], self.other_book, 2023, 3, 5)
+        self.refresh()
+
+        url = reverse("admin-views-series")
+        response = self.client.get(
+            url, {"start": "2023-01-01", "end": "2023-04-30", "interval": "month"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["views"], 3)
+        self.assertEqual(
+            [(str(point["period"]), point["views"]) for point in response.data["series"]],
+            [("2023-01-01", 1), ("2023-02-01", 0), ("2023-03-01", 2), ("2023-04-01", 0)],
+        )
+
+        # Weeks start on Monday, 2023-02-27 for both March reads
+        response = self.client.get(
+            url,
+            {
+                "start": "2023-02-27",
+                "end": "2023-03-12",
+                "interval": "week",
+                "books": str(self.book.id),
+            },
+        )
+        self.assertEqual(
+            [(str(point["period"]), point["views"]) for point in response.data["series"]],
+            [("2023-02-27", 1), ("2023-03-06", 0)],
+        )
+
+        response = self.client.get(url, {"start": "2023-01-01", "end": "2023-01-31"})
+        self.assertEqual(len(response.data["series"]), 31)
+        self.assertEqual(response.data["series"][29]["views"], 1)
+
+    def test_views_series_until_date_max(self):
+        url = reverse("admin-views-series")
+        for interval, periods in (("day", 31), ("week", 5), ("month", 1)):
+            response = self.client.get(
+                url, {"start": "9999-12-01", "end": "9999-12-31", "interval": interval}
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data["series"]), periods)
+        self.assertEqual(countPeriods(date(1, 1, 1), date.max, "month"), 119988)
+
+    def test_views_series_invalid(self):
+        url = reverse("admin-views-series")
+        for params in (
+            {"interval": "year"},
+            {"start": "2023-13-01"},
+            {"start": "2023-02-01", "end": "2023-01-01"},
+            {"start": "2000-01-01", "end": "2023-01-01"},
+            {"start": "0001-01-01", "end": "9999-12-31"},
+            {"end": "0001-01-05"},
+            {"books": "1,a"},
+        ):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = User.objects.create_user(
+            username="adminuser", password="adminpassword", is_staff=True
+        )
+        self.client.force_authenticate(user=self.admin_user)
+        self.books = [
+            Book.objects.create(title=f"Book {i}", published_by=self.admin_user)
+            for i in range(3)
+        ]
+        self.readers = [
+            User.objects.create_user(username=f"reader{i}", password="password")
+            for i in range(20)
+        ]
+
+    def refresh(self):
+        call_command("refresh_leaderboards", stdout=StringIO())
+
+    def test_reads_leaderboards(self):
+        now = django_timezone.now()
+        for reader in self.readers[:3]:
+            ReadBook.objects.create(user=reader, book=self.books[0], read_date=now)
+        for reader in self.readers[:5]:
+            ReadBook.objects.create(
+                user=reader, book=self.books[1], read_date=now - timedelta(days=60)
+            )
+        self.refresh()
+
+        url = reverse("admin-leaderboard", args=["all-time"])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(entry["id"], entry["reads"]) for entry in response.data["results"]],
+            [(self.books[1].id, 5), (self.books[0].id, 3)],
+        )
+
+        response = self.client.get(reverse("admin-leaderboard", args=["7-days"]))
+        self.assertEqual(
+            [(entry["rank"], entry["id"]) for entry in response.data["results"]],
+            [(1, self.books[0].id)],
+        )
+
+        response = self.client.get(url, {"limit": 1})
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_rating_leaderboard_is_weighted(self):
+        # Two 5 star ratings rank below eighteen ratings averaging 4.9
+        for reader in self.readers[:2]:
+            Rating.objects.create(user=reader, book=self.books[0], rating=5)
+        for i, reader in enumerate(self.readers[2:]):
+            Rating.objects.create(
+                user=reader, book=self.books[1], rating=4 if i < 2 else 5
+            )
+        for reader in self.readers[:4]:
+            Rating.objects.create(user=reader, book=self.books[2], rating=1)
+        call_command("recount_book_stats", stdout=StringIO())
+        self.refresh()
+
+        response = self.client.get(
+            reverse("admin-leaderboard", args=["all-time"]), {"metric": "rating"}
+        )
+        self.assertEqual(
+            [entry["id"] for entry in response.data["results"]],
+            [self.books[1].id, self.books[0].id, self.books[2].id],
+        )
+        self.assertEqual(response.data["results"][1]["average_rating"], 5)
+        self.assertEqual(response.data["results"][1]["total_ratings"], 2)
+
+    def test_invalid_leaderboard(self):
+        response = self.client.get(reverse("admin-leaderboard", args=["year"]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(
+            reverse("admin-leaderboard", args=["month"]), {"metric": "rating"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(
+            reverse("admin-leaderboard", args=["month"]), {"limit": "0"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -13,12 +13,16 @@ from .views import (
     getYearlyViews,
     getYearlyViewsPerBook,
     getMonthlyViews,
-    getMonthlyViewsPerBook
+    getMonthlyViewsPerBook,
+    getViewsSeriesView,
+    getLeaderboardView,
+    getCacheStatsView,
 )
 
 urlpatterns = [
     path("", index, name="admin-index"),
     path("views/", getAllTimeViews, name="admin-views"),
+    path("views/series/", getViewsSeriesView, name="admin-views-series"),
     path("views/<int:id>/", getViewsPerBook, name="admin-views-book"),
     path("views/year=<int:year>/", getYearlyViews, name="admin-views-year"),
     path(
@@ -32,9 +36,11 @@ urlpatterns = [
         getMonthlyViewsPerBook,
         name="admin-views-month-book",
     ),
+    path("leaderboards/<str:board>/", getLeaderboardView, name="admin-leaderboard"),
+    path("cache/stats/", getCacheStatsView, name="admin-cache-stats"),
     path("books/", ListBooksView.as_view(), name="admin-books"),
-    path("books/<int:book_id>/", bookView, name="admin-books-detail"),
+    path("books/<int:id>/", bookView, name="admin-books-detail"),
     path("books/upload/", uploadBookView, name="upload-book"),
-    path("books/edit/<int:book_id>/", updateBookView, name="admin-books-edit"),
-    path("books/delete/<int:book_id>/", deleteBookView, name="admin-books-delete"),
+    path("books/edit/<int:id>/", updateBookView, name="admin-books-edit"),
+    path("books/delete/<int:id>/", deleteBookView, name="admin-books-delete"),
 ]
@@ -1,14 +1,31 @@
+from datetime import date, timedelta
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
-from django.db.models import Count
+from django.db.models import Count, Sum
 from knox.auth import TokenAuthentication
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 
+from books.cache import getCacheStats
 from books.models import Book
 from .enums import getMonth
+from .models import BookDailyViews, BookRanking
+from .rollups import SERIES_INTERVALS, countPeriods, getViewsSeries
+
+# Most periods and books a views series can be requested for at once
+MAX_SERIES_PERIODS = 1000
+MAX_SERIES_BOOKS = 100
+
+
+def getViews(**filters) -> dict:
+    # Sum the daily views rollup, refreshed by the refresh_daily_views command
+    views = BookDailyViews.objects.filter(**filters).aggregate(
+        views=Sum("reads"), books=Count("book", distinct=True)
+    )
+    views["views"] = views["views"] or 0
+    return views
 
 
 # localhost:8000/tll-admin/ (name="admin-index")
@@ -25,10 +42,7 @@ def index(request):
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated, IsAdminUser])
 def getAllTimeViews(request):
-    views = 0
-    books = Book.objects.all()
-    for book in books:
-        views += book.read_by.count()
+    views = getViews()["views"]
 
     # Return the number of views
     return Response({"views": views}, status=status.HTTP_200_OK)
@@ -40,11 +54,10 @@ def getAllTimeViews(request):
 @permission_classes([IsAuthenticated, IsAdminUser])
 def getViewsPerBook(request, id: int):
     # Get the book
-    book = get_object_or_404(Book, id=id)
+    get_object_or_404(Book.objects.only("id"), id=id)
+    views = getViews(book_id=id)["views"]
     # Return the number of views
-    return Response(
-        {"id": id, "views": book.read_by.count()}, status=status.HTTP_200_OK
-    )
+    return Response({"id": id, "views": views}, status=status.HTTP_200_OK)
 
 
 # localhost:8000/tll-admin/views/year=<int:year>/ (name="admin-views-year")
@@ -52,24 +65,15 @@ def getViewsPerBook(request, id: int):
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated, IsAdminUser])
 def getYearlyViews(request, year: int):
-    # Get the number of users who read each book in the specified year
-    books_read_with_readers_count = (
-        Book.objects.filter(read_by__readbook__read_date__year=year)
-        .annotate(readers_count=Count("read_by__readbook__user"))
-        .distinct()
-    )
-
-    num_of_books_read = books_read_with_readers_count.count()
-    num_of_views = 0
-    for book in books_read_with_readers_count:
-        num_of_views += book.readers_count
+    # Get the number of books read and of views in the specified year
+    views = getViews(day__year=year)
 
     # Return the number of views
     return Response(
         {
             "year": year,
-            "number of books read": num_of_books_read,
-            "views": num_of_views,
+            "number of books read": views["books"],
+            "views": views["views"],
         },
         status=status.HTTP_200_OK,
     )
@@ -81,13 +85,13 @@ def getYearlyViews(request, year: int):
 @permission_classes([IsAuthenticated, IsAdminUser])
 def getYearlyViewsPerBook(request, id: int, year: int):
     # Get the book
-    book = get_object_or_404(Book, id=id)
+    get_object_or_404(Book.objects.only("id"), id=id)
     # Get the number of users who read the book in the specified year
-    readers_count = book.read_by.filter(readbook__read_date__year=year).count()
+    views = getViews(book_id=id, day__year=year)["views"]
 
     # Return the number of views
     return Response(
-        {"year": year, "id": id, "views": readers_count}, status=status.HTTP_200_OK
+        {"year": year, "id": id, "views": views}, status=status.HTTP_200_OK
     )
 
 
@@ -103,20 +107,8 @@ def getMonthlyViews(request, month: int, year: int):
             {"message": "Invalid month number"},
             status=status.HTTP_400_BAD_REQUEST,
         )
-    # Get the number of users who read each book in the specified month
-    books_read_with_readers_count = (
-        Book.objects.filter(
-            read_by__readbook__read_date__year=year,
-            read_by__readbook__read_date__month=month,
-        )
-        .annotate(readers_count=Count("read_by__readbook__user"))
-        .distinct()
-    )
-
-    num_of_books_read = books_read_with_readers_count.count()
-    num_of_views = 0
-    for book in books_read_with_readers_count:
-        num_of_views += book.readers_count
+    # Get the number of books read and of views in the specified month
+    views = getViews(day__year=year, day__month=month)
 
     # Return the number of views
     return Response(
@@ -124,8 +116,8 @@ def getMonthlyViews(request, month: int, year: int):
             "year": year,
             "month_number": month,
             "month_name": month_name,
-            "number of books read": num_of_books_read,
-            "views": num_of_views,
+            "number of books read": views["books"],
+            "views": views["views"],
         },
         status=status.HTTP_200_OK,
     )
@@ -144,11 +136,9 @@ def getMonthlyViewsPerBook(request, id: int, month: int, year: int):
             status=status.HTTP_400_BAD_REQUEST,
         )
     # Get the book
-    book = get_object_or_404(Book, id=id)
+    get_object_or_404(Book.objects.only("id"), id=id)
     # Get the number of users who read the book in the specified month
-    readers_count = book.read_by.filter(
-        readbook__read_date__year=year, readbook__read_date__month=month
-    ).count()
+    views = getViews(book_id=id, day__year=year, day__month=month)["views"]
 
     # Return the number of views
     return Response(
@@ -157,7 +147,132 @@ def getMonthlyViewsPerBook(request, id: int, month: int, year: int):
             "month_number": month,
             "month_name": month_name,
             "id": id,
-            "views": readers_count,
+            "views": views,
         },
         status=status.HTTP_200_OK,
     )
+
+
+# localhost:8000/tll-admin/views/series/?start=<date>&end=<date>&interval=<day|week|month>&books=<ids> (name="admin-views-series")
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def getViewsSeriesView(request):
+    interval = request.query_params.get("interval", "day")
+    if interval not in SERIES_INTERVALS:
+        return Response(
+            {"message": "Invalid interval, use day, week or month"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    # The last 30 days by default
+    try:
+        end = date.fromisoformat(request.query_params.get("end", date.today().isoformat()))
+        start = date.fromisoformat(
+            request.query_params.get("start", (end - timedelta(days=29)).isoformat())
+        )
+        books = request.query_params.get("books")
+        book_ids = [int(id) for id in books.split(",")] if books else None
+    except (ValueError, OverflowError):
+        return Response(
+            {"message": "Invalid start, end or books"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if start > end:
+        return Response(
+            {"message": "start must not be after end"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if countPeriods(start, end, interval) > MAX_SERIES_PERIODS:
+        return Response(
+            {"message": f"At most {MAX_SERIES_PERIODS} periods can be requested"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if book_ids and len(book_ids) > MAX_SERIES_BOOKS:
+        return Response(
+            {"message": f"At most {MAX_SERIES_BOOKS} books can be requested"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    series = getViewsSeries(start, end, interval, book_ids)
+    return Response(
+        {
+            "start": start,
+            "end": end,
+            "interval": interval,
+            "books": book_ids,
+            "views": sum(point["views"] for point in series),
+            "series": series,
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+# localhost:8000/tll-admin/leaderboards/<str:board>/?metric=<reads|rating>&limit=<n> (name="admin-leaderboard")
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def getLeaderboardView(request, board: str):
+    metric = request.query_params.get("metric", BookRanking.Metric.READS)
+    if board not in BookRanking.Board.values or metric not in BookRanking.Metric.values:
+        return Response(
+            {"message": "Leaderboard not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+    if metric == BookRanking.Metric.RATING and board != BookRanking.Board.ALL_TIME:
+        return Response(
+            {"message": "Ratings are only ranked all-time"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        limit = int(request.query_params.get("limit", 20))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return Response(
+            {"message": "limit must be a positive integer"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    # One range scan of the (board, metric, rank) index
+    rankings = list(
+        BookRanking.objects.filter(board=board, metric=metric, rank__lte=limit)
+        .select_related("book")
+        .only(
+            "rank",
+            "score",
+            "count",
+            "date_computed",
+            "book__title",
+            "book__rating_sum",
+            "book__rating_count",
+        )
+        .order_by("rank")
+    )
+    results = []
+    for ranking in rankings:
+        entry = {"rank": ranking.rank, "id": ranking.book_id, "title": ranking.book.title}
+        if metric == BookRanking.Metric.READS:
+            entry["reads"] = ranking.count
+        else:
+            entry["score"] = round(ranking.score, 2)
+            entry["average_rating"] = ranking.book.average_rating
+            entry["total_ratings"] = ranking.count
+        results.append(entry)
+
+    return Response(
+        {
+            "board": board,
+            "metric": metric,
+            "date_computed": rankings[0].date_computed if results else None,
+            "results": results,
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+# localhost:8000/tll-admin/cache/stats/ (name="admin-cache-stats")
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def getCacheStatsView(request):
+    # Return the hits, misses and hit ratio of the book response cache
+    return Response(getCacheStats(), status=status.HTTP_200_OK)
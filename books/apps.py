@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.core.signals import request_finished
+from django.db.models.signals import post_migrate
 
 
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
+
+    def ready(self):
+        from . import signals  # noqa: F401 (connects the cache invalidation)
+        from .readbuffer import flushReadBufferIfDue
+        from .search import createSearchIndex
+
+        # Write buffered read events once the response has been sent
+        request_finished.connect(flushReadBufferIfDue)
+
+        # The search index is a raw table (FTS5 or tsvector), created after migrate
+        post_migrate.connect(createSearchIndex, sender=self)
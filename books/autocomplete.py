@@ -0,0 +1,248 @@
+import bisect
+import logging
+import re
+import threading
+import time
+import unicodedata
+from django.conf import settings
+from django.db import DatabaseError
+from .cache import bumpVersion, getVersion
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+# Default and maximum number of suggestions
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 20
+# Least similarity of the query words to the words of a title for a typo, where
+# a word one edit away from a six letter word scores 1 - 1/6
+FUZZY_THRESHOLD = getattr(settings, "AUTOCOMPLETE_FUZZY_THRESHOLD", 0.6)
+# Seconds between two checks of the titles version in the shared cache
+CHECK_INTERVAL = getattr(settings, "AUTOCOMPLETE_CHECK_INTERVAL", 1)
+
+VERSION_NAME = "titles"
+WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    # Lower case words without accents, so "Émile" is suggested for "emi"
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(WORD_RE.findall(text))
+
+
+def getTrigrams(text: str) -> set:
+    # Trigrams of each word padded like pg_trgm: "  w", " wo", "wor", "ord", "rd "
+    trigrams = set()
+    for word in text.split():
+        word = f"  {word} "
+        trigrams.update(word[i : i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+def editDistance(a: str, b: str) -> int:
+    # Optimal string alignment distance, a transposed pair of letters is one edit
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+
+def wordSimilarity(query: str, word: str, prefix: bool = False) -> float:
+    # 1 for the same word down to 0, a word being typed is also compared to a prefix
+    if prefix and len(word) > len(query):
+        return max(wordSimilarity(query, word), wordSimilarity(query, word[: len(query)]))
+    longest = max(len(query), len(word))
+    if abs(len(query) - len(word)) > longest * (1 - FUZZY_THRESHOLD):
+        return 0
+    return 1 - editDistance(query, word) / longest
+
+
+class TitleIndex:
+    """
+    In-memory index of the book titles for the autocomplete view.
+
+    Every word of a title starts a key in a sorted list, so a prefix of any
+    word is found with two bisections. For queries with typos, an inverted
+    index of trigrams finds the title words close to each query word, which
+    are then compared by edit distance. Changes made by this process are
+    applied incrementally; changes made by other processes bump the "titles"
+    version in the shared cache, after which the index is loaded again.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []
+        self._titles = {}
+        self._trigrams = {}
+        self._words = {}
+        self._version = None
+        self._checked = 0
+
+    def __len__(self):
+        return len(self._titles)
+
+    def load(self):
+        # Read the version first, so a change made while loading is seen later
+        version = getVersion(VERSION_NAME)
+        titles = dict(Book.objects.values_list("id", "title"))
+        with self._lock:
+            self._keys, self._titles, self._trigrams, self._words = [], {}, {}, {}
+            for book_id, title in titles.items():
+                self._add(book_id, title, sort=False)
+            self._keys.sort()
+            self._version = version
+            self._checked = time.monotonic()
+
+    def warm(self):
+        # Called when the server starts, before the database may be migrated
+        try:
+            self.load()
+        except DatabaseError:
+            logger.warning("Could not load the book titles for autocomplete")
+
+    def refreshIfStale(self):
+        # At most one cache lookup per CHECK_INTERVAL, never a database query
+        if self._version is None:
+            self.load()
+            return
+        if time.monotonic() - self._checked < CHECK_INTERVAL:
+            return
+        if getVersion(VERSION_NAME) != self._version:
+            self.load()
+        else:
+            self._checked = time.monotonic()
+
+    def _add(self, book_id: int, title: str, sort: bool = True):
+        normalized = normalize(title)
+        words = normalized.split()
+        self._titles[book_id] = (title, normalized)
+        for i in range(len(words)):
+            key = (" ".join(words[i:]), i, book_id)
+            if sort:
+                bisect.insort(self._keys, key)
+            else:
+                self._keys.append(key)
+        for word in words:
+            self._words.setdefault(word, set()).add(book_id)
+            for trigram in getTrigrams(word):
+                self._trigrams.setdefault(trigram, set()).add(word)
+
+    def _remove(self, book_id: int):
+        title, normalized = self._titles.pop(book_id)
+        words = normalized.split()
+        for i in range(len(words)):
+            key = (" ".join(words[i:]), i, book_id)
+            index = bisect.bisect_left(self._keys, key)
+            if index < len(self._keys) and self._keys[index] == key:
+                del self._keys[index]
+        for word in set(words):
+            ids = self._words.get(word)
+            if ids is None:
+                continue
+            ids.discard(book_id)
+            if ids:
+                continue
+            # The last title with the word is gone
+            del self._words[word]
+            for trigram in getTrigrams(word):
+                trigram_words = self._trigrams.get(trigram)
+                if trigram_words is not None:
+                    trigram_words.discard(word)
+                    if not trigram_words:
+                        del self._trigrams[trigram]
+
+    def update(self, book_id: int, title: str = None):
+        """
+        Apply a created or renamed book (or a deleted one when title is None)
+        and tell the other processes to reload their index.
+        """
+        with self._lock:
+            if book_id in self._titles:
+                self._remove(book_id)
+            if title is not None:
+                self._add(book_id, title)
+            version = bumpVersion(VERSION_NAME)
+            # Only this change happened since the index was loaded
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def _fuzzyScores(self, query_words: list) -> dict:
+        """
+        Score the titles by the mean similarity of each query word to its
+        closest word in the title. Only the title words sharing a trigram
+        with a query word are compared, and the last query word may not be
+        fully typed yet.
+        """
+        scores = {}
+        for position, query_word in enumerate(query_words):
+            prefix = position == len(query_words) - 1
+            candidates = set()
+            for trigram in getTrigrams(query_word):
+                candidates.update(self._trigrams.get(trigram, ()))
+            best = {}
+            for word in candidates:
+                similarity = wordSimilarity(query_word, word, prefix)
+                if similarity == 0:
+                    continue
+                for book_id in self._words[word]:
+                    best[book_id] = max(best.get(book_id, 0), similarity)
+            for book_id, similarity in best.items():
+                scores[book_id] = scores.get(book_id, 0) + similarity / len(query_words)
+        return scores
+
+    def suggest(self, query: str, limit: int = DEFAULT_SUGGESTIONS) -> list:
+        """
+        Return up to `limit` (book id, title, match) suggestions for a query.
+
+        Titles with a word starting with the query come first, those starting
+        with it before the others, then titles whose words are similar enough
+        to the query words when it has a typo.
+        """
+        query = normalize(query or "")
+        if not query:
+            return []
+        self.refreshIfStale()
+
+        with self._lock:
+            # Keys starting with the query are between query and query + max char
+            start = bisect.bisect_left(self._keys, (query,))
+            end = bisect.bisect_left(self._keys, (query + "\U0010ffff",), lo=start)
+            matches = sorted(
+                self._keys[start:end],
+                key=lambda key: (key[1] > 0, len(self._titles[key[2]][1]), key[2]),
+            )
+            # A title matches once, at its best word
+            found = {}
+            for _, _, book_id in matches:
+                found.setdefault(book_id, self._titles[book_id][0])
+                if len(found) == limit:
+                    break
+            suggestions = [(id, title, "prefix") for id, title in found.items()]
+
+            if len(suggestions) < limit and len(query) >= 3:
+                scores = self._fuzzyScores(query.split())
+                fuzzy = sorted(
+                    (
+                        (score, book_id)
+                        for book_id, score in scores.items()
+                        if book_id not in found and score >= FUZZY_THRESHOLD
+                    ),
+                    key=lambda item: (-item[0], len(self._titles[item[1]][1]), item[1]),
+                )
+                suggestions += [
+                    (book_id, self._titles[book_id][0], "fuzzy")
+                    for _, book_id in fuzzy[: limit - len(suggestions)]
+                ]
+        return suggestions
+
+
+titleIndex = TitleIndex()
@@ -0,0 +1,100 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Cache used for the book responses and how long an entry may live
+CACHE_ALIAS = getattr(settings, "BOOKS_CACHE_ALIAS", "default")
+CACHE_TIMEOUT = getattr(settings, "BOOKS_CACHE_TIMEOUT", 60 * 60)
+
+HITS_KEY = "books:stats:hits"
+MISSES_KEY = "books:stats:misses"
+
+
+def getCache():
+    return caches[CACHE_ALIAS]
+
+
+def incrementKey(key: str, initial: int = 1) -> int:
+    # incr() fails on a missing key, so create it first when needed
+    cache = getCache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, initial, timeout=None):
+            return initial
+        return cache.incr(key)
+
+
+def getVersion(name: str) -> int:
+    """
+    Get the current version of a cached resource.
+
+    A missing version starts at the current time in nanoseconds rather than
+    at 1, so that entries cached under an evicted version are never reused.
+    """
+    cache = getCache()
+    key = f"books:version:{name}"
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bumpVersion(name: str) -> int:
+    return incrementKey(f"books:version:{name}", initial=time.time_ns())
+
+
+def invalidate(*names: str):
+    """
+    Bump the versions of the given cached resources.
+
+    The versions are bumped right away and again once the current transaction
+    commits, so a response rebuilt from not yet committed rows is not kept.
+    """
+
+    def bump():
+        for name in names:
+            bumpVersion(name)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def invalidateBook(book_id: int):
+    # Invalidate the cached detail of a book and the cached catalog
+    invalidate(f"book:{book_id}", "catalog")
+
+
+def invalidateCommentLikes(comment_id: int, book_id: int, parent_comment_id=None):
+    # Invalidate the likes of a comment and the comment lists showing its likes
+    names = [f"likes:{comment_id}", f"comments:{book_id}", f"thread:{book_id}"]
+    if parent_comment_id is not None:
+        names.append(f"replies:{parent_comment_id}")
+    invalidate(*names)
+
+
+def cachedData(key: str, build):
+    # Get the data cached under key, building and caching it on a miss
+    cache = getCache()
+    data = cache.get(key)
+    if data is not None:
+        incrementKey(HITS_KEY)
+        return data
+    incrementKey(MISSES_KEY)
+    data = build()
+    cache.set(key, data, timeout=CACHE_TIMEOUT)
+    return data
+
+
+def getCacheStats() -> dict:
+    cache = getCache()
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else 0,
+    }
@@ -0,0 +1,29 @@
+import brotli
+
+# Brotli quality used for stored content, 11 is the slowest and smallest
+COMPRESSION_QUALITY = 9
+
+
+def compressText(text: str) -> bytes:
+    return brotli.compress(text.encode("utf-8"), quality=COMPRESSION_QUALITY)
+
+
+def decompressText(data: bytes) -> str:
+    return brotli.decompress(bytes(data)).decode("utf-8")
+
+
+def acceptsBrotli(request) -> bool:
+    # Check the Accept-Encoding header for br, honouring "br;q=0"
+    header = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    for coding in header.split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() != "br":
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
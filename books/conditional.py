@@ -0,0 +1,41 @@
+import hashlib
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from .cache import getVersion
+
+
+def makeETag(name: str, *parts) -> str:
+    """
+    Build a strong ETag for a resource from the current version of `name`.
+
+    The version changes whenever the resource changes, so the ETag can be
+    computed and checked without building the response. Extra parts (e.g. the
+    query string) distinguish different representations of the resource.
+    """
+    tag = f"{name}-{getVersion(name)}"
+    if parts:
+        digest = hashlib.md5("&".join(str(part) for part in parts).encode())
+        tag += "-" + digest.hexdigest()[:12]
+    return '"{}"'.format(tag.replace(":", "-"))
+
+
+def isNotModified(request, etag: str, exists: bool = False) -> bool:
+    """
+    Return whether the client's If-None-Match header matches `etag`.
+
+    "*" matches any current representation, so it is only honoured when the
+    caller passes `exists` once it knows the resource exists; a missing
+    resource must still get its 404. Other tags use the weak comparison,
+    so W/ prefixes are ignored.
+    """
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return exists
+    return etag in [tag.removeprefix("W/") for tag in parse_etags(header)]
+
+
+def notModifiedResponse(etag: str) -> Response:
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
@@ -0,0 +1,48 @@
+import os
+from abc import ABC, abstractmethod
+import cloudinary.uploader
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.module_loading import import_string
+
+
+class ImageHost(ABC):
+    """
+    Stores cover images and returns the URL clients download them from.
+
+    Uploaded files are named after their content hash, so uploading a name
+    that is already hosted keeps the existing image rather than a new copy.
+    """
+
+    @abstractmethod
+    def upload(self, file, folder: str) -> str:
+        pass
+
+
+class CloudinaryImageHost(ImageHost):
+    def upload(self, file, folder: str) -> str:
+        # Cloudinary drops the extension from the public id, so the file names
+        # must differ without it
+        public_id = os.path.splitext(os.path.basename(file.name))[0]
+        result = cloudinary.uploader.upload(
+            file,
+            folder=folder,
+            public_id=public_id,
+            overwrite=False,
+        )
+        return result["secure_url"]
+
+
+class LocalImageHost(ImageHost):
+    # Stand-in storing the images with the default storage, for offline use
+    def upload(self, file, folder: str) -> str:
+        name = os.path.join("image_host", folder, os.path.basename(file.name))
+        if not default_storage.exists(name):
+            name = default_storage.save(name, file)
+        return default_storage.url(name)
+
+
+def getImageHost() -> ImageHost:
+    # The image host class is set by the BOOKS_IMAGE_HOST setting
+    path = getattr(settings, "BOOKS_IMAGE_HOST", "books.imagehost.CloudinaryImageHost")
+    return import_string(path)()
@@ -0,0 +1,83 @@
+import atexit
+import multiprocessing
+from io import BytesIO
+from PIL import Image, ImageOps
+from django.conf import settings
+
+# Bounding boxes of the cover derivatives, covers are never upscaled
+DERIVATIVE_SIZES = {
+    "thumbnail": (160, 240),
+    "list": (320, 480),
+    "detail": (640, 960),
+}
+# Pillow format and save options of each derivative encoding
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+# Number of processes resizing covers, 0 resizes in the calling process
+IMAGE_WORKERS = getattr(settings, "COVER_IMAGE_WORKERS", 2)
+# Seconds a cover may take to render before its process is killed
+IMAGE_TIMEOUT = getattr(settings, "COVER_IMAGE_TIMEOUT", 60)
+
+_pool = None
+
+
+def renderDerivatives(data: bytes) -> dict:
+    """
+    Resize and re-encode a cover image into every derivative size and format.
+
+    Takes and returns plain bytes so that it can run in a worker process,
+    the result maps each size name to a dictionary of format to image bytes.
+    """
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        derivatives = {}
+        for size_name, size in DERIVATIVE_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            derivatives[size_name] = {}
+            for format_name, (pil_format, options) in DERIVATIVE_FORMATS.items():
+                output = BytesIO()
+                resized.save(output, format=pil_format, **options)
+                derivatives[size_name][format_name] = output.getvalue()
+    return derivatives
+
+
+def getPool():
+    global _pool
+    if _pool is None:
+        _pool = multiprocessing.Pool(processes=IMAGE_WORKERS)
+    return _pool
+
+
+def terminatePool():
+    # Kill the pool processes, including a render that is still running
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool = None
+
+
+atexit.register(terminatePool)
+
+
+def generateDerivatives(data: bytes) -> dict:
+    """
+    Render the derivatives of a cover in the process pool.
+
+    The call waits for the result, so the job worker is busy meanwhile, but
+    a Pillow crash or memory spike only takes down a pool process. A render
+    still running after IMAGE_TIMEOUT seconds is stopped by terminating the
+    pool, which is created again by the next call, and TimeoutError is
+    raised so that the job is retried.
+    """
+    if not IMAGE_WORKERS:
+        return renderDerivatives(data)
+    result = getPool().apply_async(renderDerivatives, (data,))
+    try:
+        return result.get(timeout=IMAGE_TIMEOUT)
+    except multiprocessing.TimeoutError:
+        terminatePool()
+        raise TimeoutError(f"Cover rendering took more than {IMAGE_TIMEOUT} seconds")
@@ -0,0 +1,178 @@
+import logging
+import posixpath
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from .cache import invalidateBook
+from .imagehost import getImageHost
+from .imaging import generateDerivatives
+from .models import Book, Job
+
+logger = logging.getLogger(__name__)
+
+# Delay before the first retry of a failed job, doubled on every attempt
+RETRY_DELAY = getattr(settings, "JOB_RETRY_DELAY", 30)
+MAX_RETRY_DELAY = getattr(settings, "JOB_MAX_RETRY_DELAY", 60 * 60)
+# Running jobs not updated for this many seconds are assumed to be lost
+JOB_TIMEOUT = getattr(settings, "JOB_TIMEOUT", 15 * 60)
+
+handlers = {}
+
+
+def jobHandler(kind: str):
+    # Register the function running the jobs of the given kind
+    def register(function):
+        handlers[kind] = function
+        return function
+
+    return register
+
+
+def enqueue(kind: str, payload: dict, max_attempts: int = 5) -> Job:
+    if kind not in handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return Job.objects.create(kind=kind, payload=payload, max_attempts=max_attempts)
+
+
+def claimJob():
+    """
+    Mark the next due job as running and return it, or None if there is none.
+
+    On databases supporting SKIP LOCKED several workers can claim jobs at the
+    same time without ever getting the same job.
+    """
+    with transaction.atomic():
+        jobs = Job.objects.filter(
+            status=Job.Status.PENDING, run_after__lte=timezone.now()
+        ).order_by("run_after", "id")
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+        job = jobs.first()
+        if job is None:
+            return None
+        job.status = Job.Status.RUNNING
+        job.attempts += 1
+        job.save(update_fields=["status", "attempts", "date_updated"])
+    return job
+
+
+def runJob(job: Job):
+    # Run a claimed job, scheduling a retry with exponential backoff on failure
+    try:
+        job.result = handlers[job.kind](**job.payload)
+    except Exception as e:
+        logger.exception("Job %s failed", job.id)
+        job.last_error = f"{type(e).__name__}: {e}"
+        if job.attempts >= job.max_attempts:
+            job.status = Job.Status.FAILED
+        else:
+            delay = min(RETRY_DELAY * 2 ** (job.attempts - 1), MAX_RETRY_DELAY)
+            job.status = Job.Status.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+    else:
+        job.status = Job.Status.DONE
+        job.last_error = ""
+    job.save()
+
+
+def runPendingJobs(limit: int = None) -> int:
+    # Run due jobs until there are none left or `limit` jobs ran
+    count = 0
+    while limit is None or count < limit:
+        job = claimJob()
+        if job is None:
+            break
+        runJob(job)
+        count += 1
+    return count
+
+
+def requeueLostJobs() -> int:
+    """
+    Put back jobs whose worker died while running them, returns how many.
+
+    A job that used all its attempts fails instead, so a job killing its
+    worker (e.g. running out of memory) is not retried forever.
+    """
+    now = timezone.now()
+    lost = Job.objects.filter(
+        status=Job.Status.RUNNING,
+        date_updated__lt=now - timedelta(seconds=JOB_TIMEOUT),
+    )
+    with transaction.atomic():
+        lost.filter(attempts__gte=F("max_attempts")).update(
+            status=Job.Status.FAILED,
+            last_error="Worker lost while running the job",
+            date_updated=now,
+        )
+        return lost.update(status=Job.Status.PENDING)
+
+
+def getHostedCover(image_name: str, field: str):
+    # Reuse what was already uploaded for a book with the same cover file
+    values = Book.objects.filter(image_url=image_name).values_list(field, flat=True)
+    return next((value for value in values if value), None)
+
+
+@jobHandler("upload_cover")
+def uploadCover(book_id: int, image_name: str) -> dict:
+    # Upload the cover of a book to the image host and link it to the book
+    try:
+        book = Book.objects.only("id", "image_url").get(id=book_id)
+    except Book.DoesNotExist:
+        return {"skipped": "Book not found"}
+    if book.image_url.name != image_name:
+        return {"skipped": "Cover replaced by a newer upload"}
+
+    url = getHostedCover(image_name, "image_url_link")
+    if url is None:
+        with book.image_url.open("rb") as image:
+            url = getImageHost().upload(image, folder="book_covers")
+    Book.objects.filter(id=book_id).update(image_url_link=url)
+    invalidateBook(book_id)
+    return {"image_url": url}
+
+
+@jobHandler("cover_derivatives")
+def createCoverDerivatives(book_id: int, image_name: str) -> dict:
+    # Upload resized copies of the cover of a book to the image host
+    try:
+        book = Book.objects.only("id", "image_url").get(id=book_id)
+    except Book.DoesNotExist:
+        return {"skipped": "Book not found"}
+    if book.image_url.name != image_name:
+        return {"skipped": "Cover replaced by a newer upload"}
+
+    urls = getHostedCover(image_name, "image_derivatives")
+    if urls is None:
+        # A misconfigured host fails before the derivatives are rendered
+        image_host = getImageHost()
+        with book.image_url.open("rb") as image:
+            derivatives = generateDerivatives(image.read())
+
+        # Named after the content hash of the cover they are made from, with
+        # the format in the stem as some hosts ignore the extension
+        digest = posixpath.splitext(posixpath.basename(image_name))[0]
+        urls = {}
+        for size_name, images in derivatives.items():
+            urls[size_name] = {
+                format_name: image_host.upload(
+                    ContentFile(data, name=f"{digest}-{size_name}-{format_name}.{format_name}"),
+                    folder="book_covers/derivatives",
+                )
+                for format_name, data in images.items()
+            }
+    Book.objects.filter(id=book_id).update(image_derivatives=urls)
+    invalidateBook(book_id)
+    return {"image_derivatives": urls}
+
+
+def enqueueCoverUpload(book: Book) -> Job:
+    # Upload the cover and create its derivatives, returns the cover upload job
+    payload = {"book_id": book.id, "image_name": book.image_url.name}
+    job = enqueue("upload_cover", payload)
+    enqueue("cover_derivatives", payload)
+    return job
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.cache import invalidateBook
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = "Compress the plain text content of books into content_br"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of books compressed per transaction",
+        )
+
+    def handle(self, *args, **options):
+        books = Book.objects.order_by("id").exclude(content="").only("id", "content")
+
+        compressed = 0
+        saved = 0
+        last_id = 0
+        while True:
+            batch = list(books.filter(id__gt=last_id)[: options["batch_size"]])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for book in batch:
+                size = len(book.content.encode("utf-8"))
+                book.setContent(book.content)
+                saved += size - len(book.content_br)
+            with transaction.atomic():
+                Book.objects.bulk_update(batch, ["content", "content_br"])
+                # bulk_update sends no post_save, the content itself is unchanged
+                # so only the cached responses need to be invalidated
+                for book in batch:
+                    invalidateBook(book.id)
+            compressed += len(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Compressed {compressed} books, saved {saved} bytes")
+        )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from books.models import Book
+from books.pages import paginateBook
+
+
+class Command(BaseCommand):
+    help = "Split the content of books into pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Paginate every book again, not only the books without pages",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of books loaded at once",
+        )
+
+    def handle(self, *args, **options):
+        books = Book.objects.order_by("id").only("id", "content", "content_br")
+        if not options["all"]:
+            books = books.filter(page_count=0)
+
+        paginated = 0
+        last_id = 0
+        while True:
+            batch = list(books.filter(id__gt=last_id)[: options["batch_size"]])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for book in batch:
+                paginateBook(book, book.getContent())
+            paginated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Paginated {paginated} books"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.models import Book, BookPage
+from books.pages import paginateBook, splitContent
+from books.search import clearSearchIndex, createSearchIndex, indexBook, indexPages
+
+
+class Command(BaseCommand):
+    help = "Index the title, content and pages of every book for the search view"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of books loaded at once",
+        )
+
+    def handle(self, *args, **options):
+        books = Book.objects.order_by("id").only("id", "title", "content", "content_br")
+
+        indexed = 0
+        last_id = 0
+        createSearchIndex()
+        with transaction.atomic():
+            clearSearchIndex()
+            while True:
+                batch = list(books.filter(id__gt=last_id)[: options["batch_size"]])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                page_ids = {}
+                for book_id, page_id in (
+                    BookPage.objects.filter(book__in=batch)
+                    .order_by("book", "number")
+                    .values_list("book", "id")
+                ):
+                    page_ids.setdefault(book_id, []).append(page_id)
+                for book in batch:
+                    content = book.getContent()
+                    indexBook(book.id, book.title, content)
+                    # The pages are split from the content rather than decompressed
+                    pages = splitContent(content)
+                    if len(pages) == len(page_ids.get(book.id, [])):
+                        indexPages(list(zip(page_ids[book.id], pages)))
+                    else:
+                        paginateBook(book, content)
+                indexed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} books"))
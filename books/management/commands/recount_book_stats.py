@@ -0,0 +1,140 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from books.cache import invalidateBook, invalidateCommentLikes
+from books.models import Book, Comment, Rating, ReadBook
+
+COUNTERS = [
+    "rating_sum",
+    "rating_count",
+    *[f"rating_{stars}" for stars in range(1, 6)],
+    "comment_count",
+    "total_comment_count",
+    "reader_count",
+]
+COMMENT_COUNTERS = ["reply_count", "like_count"]
+
+
+def countSubquery(queryset, aggregate, field: str = "book"):
+    # Correlated subquery returning a single aggregate of the rows of a book
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(value=aggregate)
+            .values("value"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the rating, comment and reader counters of every book and "
+        "the reply and like counters of every comment"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of books recomputed per query",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        books = Book.objects.order_by("id").only("id", *COUNTERS).annotate(
+            actual_rating_sum=countSubquery(Rating.objects, Sum("rating")),
+            actual_rating_count=countSubquery(Rating.objects, Count("id")),
+            **{
+                f"actual_rating_{stars}": countSubquery(
+                    Rating.objects.filter(rating=stars), Count("id")
+                )
+                for stars in range(1, 6)
+            },
+            actual_comment_count=countSubquery(
+                Comment.objects.filter(parent_comment__isnull=True), Count("id")
+            ),
+            actual_total_comment_count=countSubquery(Comment.objects, Count("id")),
+            actual_reader_count=countSubquery(ReadBook.objects, Count("id")),
+        )
+
+        checked = 0
+        repaired = 0
+        last_id = 0
+        while True:
+            batch = list(books.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            checked += len(batch)
+
+            # Only write back the books whose counters drifted
+            stale = []
+            for book in batch:
+                changed = False
+                for counter in COUNTERS:
+                    actual = getattr(book, f"actual_{counter}")
+                    if getattr(book, counter) != actual:
+                        setattr(book, counter, actual)
+                        changed = True
+                if changed:
+                    stale.append(book)
+            if stale:
+                Book.objects.bulk_update(stale, COUNTERS)
+                for book in stale:
+                    invalidateBook(book.id)
+                repaired += len(stale)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} books, repaired {repaired}")
+        )
+        self.recountComments(batch_size)
+
+    def recountComments(self, batch_size: int):
+        comments = Comment.objects.order_by("id").only(
+            "id", "book_id", "parent_comment_id", *COMMENT_COUNTERS
+        ).annotate(
+            actual_reply_count=countSubquery(
+                Comment.objects, Count("id"), field="parent_comment"
+            ),
+            actual_like_count=countSubquery(
+                Comment.likes.through.objects, Count("id"), field="comment"
+            ),
+        )
+
+        checked = 0
+        repaired = 0
+        last_id = 0
+        while True:
+            batch = list(comments.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            checked += len(batch)
+
+            stale = []
+            for comment in batch:
+                changed = False
+                for counter in COMMENT_COUNTERS:
+                    actual = getattr(comment, f"actual_{counter}")
+                    if getattr(comment, counter) != actual:
+                        setattr(comment, counter, actual)
+                        changed = True
+                if changed:
+                    stale.append(comment)
+            if stale:
+                Comment.objects.bulk_update(stale, COMMENT_COUNTERS)
+                for comment in stale:
+                    invalidateCommentLikes(
+                        comment.id, comment.book_id, comment.parent_comment_id
+                    )
+                repaired += len(stale)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} comments, repaired {repaired}")
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from books.recommendations import SIMILAR_BOOKS, refreshSimilarities
+
+
+class Command(BaseCommand):
+    help = "Recompute the books read by the readers of each book"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=SIMILAR_BOOKS,
+            help="Number of similar books kept for each book",
+        )
+
+    def handle(self, *args, **options):
+        count = refreshSimilarities(options["size"])
+        self.stdout.write(self.style.SUCCESS(f"Stored {count} similar books"))
@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+
+from books.jobs import requeueLostJobs, runPendingJobs
+
+
+class Command(BaseCommand):
+    help = "Run the jobs queued in the database, e.g. cover uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run the due jobs and exit instead of waiting for more",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=2,
+            help="Seconds to wait when there is no due job",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeueLostJobs()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} lost jobs")
+            count = runPendingJobs()
+            if count:
+                self.stdout.write(f"Ran {count} jobs")
+            if options["once"]:
+                break
+            if not count:
+                time.sleep(options["sleep"])
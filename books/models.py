@@ -1,29 +1,58 @@
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from .compression import compressText, decompressText
+from .storage import getCoverStorage
 
 # Create your models here.
 
 
 def book_image_path(instance, filename):
-    # Build the file path based on the book's title
-    return f"book_covers/{instance.title}/{filename}"
+    # The cover storage renames the file after its content hash, see storage.py
+    return f"book_covers/{filename}"
 
 
 class Book(models.Model):
     title = models.CharField(max_length=255, blank=False, null=False)
-    image_url = models.ImageField(upload_to=book_image_path, blank=True, null=True)
-    content = models.TextField(blank=False, null=False)
+    image_url = models.ImageField(
+        upload_to=book_image_path,
+        storage=getCoverStorage,
+        blank=True,
+        null=True,
+        db_index=True,
+    )
+    # Plain text content, only kept until it is compressed into content_br
+    content = models.TextField(blank=True, null=False)
+    # Brotli compressed content, see compress_book_content
+    content_br = models.BinaryField(blank=True, null=True, editable=False)
     date_published = models.DateTimeField(auto_now=True)
     read_by = models.ManyToManyField(
         User, through="ReadBook", related_name="books_read", blank=True
     )
     published_by = models.ForeignKey(User, on_delete=models.CASCADE)
     image_url_link = models.URLField(blank=True, null=True)
+    # URLs of the resized covers, by size name and then by format
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    # Counters maintained by the write views, see recount_book_stats to repair them
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    # Number of ratings of each number of stars
+    rating_1 = models.IntegerField(default=0, editable=False)
+    rating_2 = models.IntegerField(default=0, editable=False)
+    rating_3 = models.IntegerField(default=0, editable=False)
+    rating_4 = models.IntegerField(default=0, editable=False)
+    rating_5 = models.IntegerField(default=0, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
+    total_comment_count = models.IntegerField(default=0, editable=False)
+    reader_count = models.IntegerField(default=0, editable=False)
+    # Number of BookPage rows the content is split into
+    page_count = models.IntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ["-date_published"]
+        indexes = [models.Index(fields=["-date_published", "-id"])]
         verbose_name = "book"
         verbose_name_plural = "books"
 
@@ -33,6 +62,51 @@ class Book(models.Model):
     def get_absolute_url(self):
         return reverse("book_detail", kwargs={"id": self.id})
 
+    def getContent(self) -> str:
+        # Plain text content takes precedence, e.g. when edited from the admin site
+        if self.content or self.content_br is None:
+            return self.content
+        return decompressText(self.content_br)
+
+    def setContent(self, content: str):
+        # Store the content compressed, the plain text field is left empty
+        self.content_br = compressText(content)
+        self.content = ""
+
+    @property
+    def average_rating(self) -> float:
+        if not self.rating_count:
+            return 0
+        return round(float(self.rating_sum / self.rating_count), 1)
+
+    @property
+    def rating_histogram(self) -> dict:
+        # Number of ratings by number of stars, from "1" to "5"
+        return {str(stars): getattr(self, f"rating_{stars}") for stars in range(1, 6)}
+
+
+class BookPage(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="pages")
+    number = models.PositiveIntegerField()
+    heading = models.CharField(max_length=255, blank=True)
+    # Brotli compressed text of the page and its number of characters
+    content_br = models.BinaryField(editable=False)
+    length = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        ordering = ["book", "number"]
+        constraints = [
+            models.UniqueConstraint(fields=["book", "number"], name="unique_book_page")
+        ]
+        verbose_name = "book page"
+        verbose_name_plural = "book pages"
+
+    def __str__(self):
+        return f"Page {self.number} of {self.book.title}"
+
+    def getContent(self) -> str:
+        return decompressText(self.content_br)
+
 
 class ReadBook(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -41,6 +115,35 @@ class ReadBook(models.Model):
 
     class Meta:
         unique_together = ("user", "book")
+        # Recounting the reads of a book on a day, see refresh_daily_views
+        indexes = [models.Index(fields=["book", "read_date"])]
+
+
+class BookSimilarity(models.Model):
+    # Nearest neighbors of each book by readers, see refresh_similar_books
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="similarities")
+    similar = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="similar_to")
+    rank = models.IntegerField()
+    # Cosine similarity of the sets of readers of the two books
+    score = models.FloatField()
+    # Number of users who read both books
+    co_readers = models.IntegerField()
+    date_computed = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["book", "rank"]
+        constraints = [
+            models.UniqueConstraint(fields=["book", "rank"], name="unique_similar_rank"),
+            models.UniqueConstraint(
+                fields=["book", "similar"], name="unique_similar_book"
+            ),
+        ]
+        indexes = [models.Index(fields=["similar", "book"])]
+        verbose_name = "book similarity"
+        verbose_name_plural = "book similarities"
+
+    def __str__(self):
+        return f"{self.similar.title} is similar to {self.book.title}"
 
 
 class Comment(models.Model):
@@ -52,6 +155,9 @@ class Comment(models.Model):
         "self", on_delete=models.CASCADE, null=True, blank=True, related_name="replies"
     )
     likes = models.ManyToManyField(User, related_name="liked_comments", blank=True)
+    # Number of direct replies and of likes, maintained by the comment views
+    reply_count = models.IntegerField(default=0, editable=False)
+    like_count = models.IntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ["date_posted"]
@@ -75,6 +181,39 @@ class Rating(models.Model):
     class Meta:
         verbose_name = "rating"
         verbose_name_plural = "ratings"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "book"], name="unique_user_rating")
+        ]
 
     def __str__(self):
         return f"{self.rating} stars on {self.book.title} by {self.user.username}"
+
+
+class Job(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    result = models.JSONField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["status", "run_after"])]
+        verbose_name = "job"
+        verbose_name_plural = "jobs"
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} ({self.status})"
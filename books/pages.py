@@ -0,0 +1,96 @@
+import re
+from django.conf import settings
+from django.db import connection, transaction
+from .compression import compressText
+from .models import Book, BookPage
+from .search import SEARCH_BACKENDS, indexPages, removePages
+
+# Maximum number of characters in a page, and of pages returned at once
+PAGE_SIZE = getattr(settings, "BOOK_PAGE_SIZE", 4000)
+MAX_PAGES_PER_REQUEST = getattr(settings, "BOOK_MAX_PAGES_PER_REQUEST", 10)
+
+HEADING_LENGTH = 80
+
+
+class InvalidPageRange(ValueError):
+    pass
+
+
+def splitContent(content: str, size: int = PAGE_SIZE) -> list:
+    """
+    Split a book's content into pages of at most `size` characters.
+
+    Pages end at a paragraph break when there is one in the second half of
+    the page, otherwise at a space, so that joining the pages gives back the
+    content unchanged.
+    """
+    pages = []
+    while len(content) > size:
+        cut = content.rfind("\n\n", size // 2, size)
+        if cut != -1:
+            cut += 2
+        else:
+            cut = content.rfind(" ", size // 2, size) + 1 or size
+        pages.append(content[:cut])
+        content = content[cut:]
+    if content:
+        pages.append(content)
+    return pages
+
+
+def getHeading(page: str) -> str:
+    # Use the first non-empty line of a page as its entry in the table of contents
+    for line in page.splitlines():
+        line = line.strip()
+        if line:
+            return line[:HEADING_LENGTH]
+    return ""
+
+
+def paginateBook(book: Book, content: str):
+    # Replace the pages of a book with the pages of its new content
+    pages = splitContent(content)
+    searchable = connection.vendor in SEARCH_BACKENDS
+    with transaction.atomic():
+        if searchable:
+            removePages(book.id)
+        BookPage.objects.filter(book=book).delete()
+        created = BookPage.objects.bulk_create(
+            [
+                BookPage(
+                    book=book,
+                    number=number,
+                    heading=getHeading(page),
+                    content_br=compressText(page),
+                    length=len(page),
+                )
+                for number, page in enumerate(pages, start=1)
+            ]
+        )
+        if searchable:
+            indexPages([(page.id, text) for page, text in zip(created, pages)])
+        Book.objects.filter(id=book.id).update(page_count=len(pages))
+    book.page_count = len(pages)
+
+
+def parsePageRange(spec: str, page_count: int) -> tuple:
+    """
+    Parse a page range such as "3", "2-5" or "4-" into (first, last).
+
+    Raises InvalidPageRange when the range is malformed or outside the book,
+    and clamps it to MAX_PAGES_PER_REQUEST pages.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*(?:(-)\s*(\d*)\s*)?", spec or "")
+    if not match:
+        raise InvalidPageRange("Invalid page range")
+    first = int(match.group(1))
+    if match.group(3):
+        last = int(match.group(3))
+    elif match.group(2):
+        last = page_count
+    else:
+        last = first
+    if first < 1 or first > last or first > page_count:
+        raise InvalidPageRange("Page range not satisfiable")
+    last = min(last, page_count, first + MAX_PAGES_PER_REQUEST - 1)
+    return first, last
@@ -0,0 +1,82 @@
+import base64
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Default and maximum number of items returned in a single page
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encodeCursor(values: list) -> str:
+    # Encode the sort key of the last item of a page as an opaque string
+    values = [
+        value.isoformat() if hasattr(value, "isoformat") else str(value)
+        for value in values
+    ]
+    payload = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decodeCursor(cursor: str) -> list:
+    # Decode a cursor created by encodeCursor back into its sort key values
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise PaginationError("Invalid cursor")
+    return values
+
+
+def getPageSize(params, default: int = DEFAULT_PAGE_SIZE) -> int:
+    # Get the page size requested in the query parameters, clamped to MAX_PAGE_SIZE
+    try:
+        limit = int(params.get("limit", default))
+    except ValueError:
+        raise PaginationError("Limit must be a number")
+    if limit < 1:
+        raise PaginationError("Limit must be at least 1")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def keysetPaginate(queryset, fields: list, cursor: str, limit: int, descending=False):
+    """
+    Return one page of a queryset ordered by `fields` together with the cursor
+    of the next page (None on the last page).
+
+    The last field must be unique (usually "id") so that every row has a
+    distinct position. The page is selected with a range condition on the
+    sort key, so the cost of a page does not depend on how deep it is.
+    """
+    prefix = "-" if descending else ""
+    lookup = "lt" if descending else "gt"
+    queryset = queryset.order_by(*[f"{prefix}{field}" for field in fields])
+
+    if cursor:
+        values = decodeCursor(cursor)
+        if len(values) != len(fields):
+            raise PaginationError("Invalid cursor")
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        for i, field in enumerate(fields):
+            equal = {fields[j]: values[j] for j in range(i)}
+            condition |= Q(**equal, **{f"{field}__{lookup}": values[i]})
+        try:
+            queryset = queryset.filter(condition)
+        except (ValidationError, ValueError, TypeError):
+            raise PaginationError("Invalid cursor")
+
+    # Fetch one extra row to know whether there is a next page
+    items = list(queryset[: limit + 1])
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encodeCursor([getattr(last, field) for field in fields])
+    return items, next_cursor
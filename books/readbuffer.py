@@ -0,0 +1,156 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Book, ReadBook
+
+logger = logging.getLogger(__name__)
+
+
+def writeReads(rows: list, batch_size: int = None):
+    """
+    Insert ReadBook rows and add the new readers to the counters of their books.
+
+    Books already read by the user are skipped by the unique constraint. The
+    pairs that already exist are looked up first, a query bounded by the
+    batch, so only the inserted rows are added to reader_count.
+    """
+    if not rows:
+        return
+    # Part of the caller's transaction when there is one, e.g. in a sync
+    with transaction.atomic(savepoint=False):
+        existing = set(
+            ReadBook.objects.filter(
+                user_id__in={row.user_id for row in rows},
+                book_id__in={row.book_id for row in rows},
+            ).values_list("user_id", "book_id")
+        )
+        inserted = Counter(
+            book_id
+            for user_id, book_id in {(row.user_id, row.book_id) for row in rows}
+            if (user_id, book_id) not in existing
+        )
+        ReadBook.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+        # One UPDATE per distinct number of new readers, usually just one
+        books_by_count = {}
+        for book_id, count in inserted.items():
+            books_by_count.setdefault(count, []).append(book_id)
+        for count, book_ids in books_by_count.items():
+            Book.objects.filter(id__in=book_ids).update(
+                reader_count=F("reader_count") + count
+            )
+
+
+class ReadBuffer:
+    """
+    Collects "user read book" events in memory and writes them in batches.
+
+    Events are coalesced per (user, book), so a user opening the same book
+    many times between two flushes costs a single row. The buffer is flushed
+    at the end of a request once it holds `batch_size` events or its oldest
+    event is `max_age` seconds old, and when the process exits. Events whose
+    write fails are kept for the next flush, up to `max_retries` times.
+    """
+
+    def __init__(self, batch_size: int, max_age: float, max_retries: int = 3):
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._events = {}
+        self._oldest = None
+        self._failures = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def record(self, user_id: int, book_id: int):
+        with self._lock:
+            self._events.setdefault((user_id, book_id), timezone.now())
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def isDue(self) -> bool:
+        if not self._events:
+            return False
+        return (
+            len(self._events) >= self.batch_size
+            or time.monotonic() - self._oldest >= self.max_age
+        )
+
+    def discard(self):
+        with self._lock:
+            self._events = {}
+            self._oldest = None
+            self._failures = 0
+
+    def restore(self, events: dict, oldest: float):
+        # Put back events that could not be written, keeping the first read date
+        with self._lock:
+            for key, read_date in events.items():
+                self._events[key] = min(read_date, self._events.get(key, read_date))
+            self._oldest = min(oldest, self._oldest or oldest)
+
+    def flush(self) -> int:
+        # Take the pending events so new reads can be recorded while writing
+        with self._lock:
+            events, self._events = self._events, {}
+            oldest, self._oldest = self._oldest, None
+        if not events:
+            return 0
+
+        try:
+            # Drop events of books or users deleted since they were recorded
+            book_ids = set(
+                Book.objects.filter(
+                    id__in={book_id for _, book_id in events}
+                ).values_list("id", flat=True)
+            )
+            user_ids = set(
+                User.objects.filter(
+                    id__in={user_id for user_id, _ in events}
+                ).values_list("id", flat=True)
+            )
+            rows = [
+                ReadBook(user_id=user_id, book_id=book_id, read_date=read_date)
+                for (user_id, book_id), read_date in events.items()
+                if user_id in user_ids and book_id in book_ids
+            ]
+            writeReads(rows, batch_size=self.batch_size)
+        except Exception:
+            self._failures += 1
+            if self._failures > self.max_retries:
+                logger.exception(
+                    "Dropped %d read events after %d failed flushes",
+                    len(events),
+                    self._failures,
+                )
+                self._failures = 0
+            else:
+                logger.exception("Failed to flush %d read events", len(events))
+                self.restore(events, oldest)
+            return 0
+        self._failures = 0
+        return len(rows)
+
+
+readBuffer = ReadBuffer(
+    batch_size=getattr(settings, "READ_BUFFER_BATCH_SIZE", 100),
+    max_age=getattr(settings, "READ_BUFFER_MAX_AGE", 5),
+    max_retries=getattr(settings, "READ_BUFFER_MAX_RETRIES", 3),
+)
+
+
+def flushReadBufferIfDue(**kwargs):
+    # Connected to request_finished in BooksConfig.ready()
+    if readBuffer.isDue():
+        readBuffer.flush()
+
+
+atexit.register(readBuffer.flush)
@@ -0,0 +1,95 @@
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import transaction
+from .models import Book, BookSimilarity, ReadBook
+
+# Number of similar books kept for each book
+SIMILAR_BOOKS = getattr(settings, "BOOKS_SIMILAR_BOOKS", 20)
+# Number of users who must have read two books for them to be similar
+MIN_CO_READERS = getattr(settings, "BOOKS_SIMILAR_MIN_CO_READERS", 1)
+
+
+def loadReads():
+    # Users and books of every read as two arrays, without building model instances
+    reads = ReadBook.objects.order_by().values_list("user_id", "book_id")
+    rows = np.fromiter(
+        (value for read in reads.iterator(chunk_size=10000) for value in read),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    return rows[:, 0], rows[:, 1]
+
+
+def computeSimilarities(
+    user_ids, book_ids, k: int = SIMILAR_BOOKS, min_co_readers: int = MIN_CO_READERS
+) -> list:
+    """
+    Return the `k` most similar books of each book as
+    (book id, similar book id, rank, score, co-readers) tuples.
+
+    Books are compared by the cosine similarity of their sets of readers: the
+    number of users who read both, divided by the geometric mean of their
+    numbers of readers. The co-occurrence counts of every pair are computed at
+    once as the sparse product of the book x user and user x book matrices.
+    """
+    if len(book_ids) == 0:
+        return []
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    books, book_index = np.unique(book_ids, return_inverse=True)
+    reads = sparse.csr_matrix(
+        (np.ones(len(book_index), dtype=np.int32), (user_index, book_index)),
+        shape=(len(users), len(books)),
+    )
+    readers = np.asarray(reads.sum(axis=0)).ravel()
+    co_readers = (reads.T @ reads).tocsr()
+    co_readers.setdiag(0)
+    co_readers.eliminate_zeros()
+
+    # Divide each count by the norms of its row and column books
+    norms = np.sqrt(readers)
+    rows = np.repeat(np.arange(len(books)), np.diff(co_readers.indptr))
+    scores = co_readers.data / (norms[rows] * norms[co_readers.indices])
+
+    similarities = []
+    for row in range(len(books)):
+        start, end = co_readers.indptr[row], co_readers.indptr[row + 1]
+        keep = np.flatnonzero(co_readers.data[start:end] >= min_co_readers) + start
+        if len(keep) > k:
+            keep = keep[np.argpartition(-scores[keep], k - 1)[:k]]
+        # Best score first, ties by book id for a stable ranking
+        keep = keep[np.lexsort((books[co_readers.indices[keep]], -scores[keep]))]
+        similarities += [
+            (
+                int(books[row]),
+                int(books[co_readers.indices[i]]),
+                rank,
+                float(scores[i]),
+                int(co_readers.data[i]),
+            )
+            for rank, i in enumerate(keep, start=1)
+        ]
+    return similarities
+
+
+def refreshSimilarities(k: int = SIMILAR_BOOKS) -> int:
+    # Recompute the similar books of every book, returns the number stored
+    similarities = computeSimilarities(*loadReads(), k=k)
+
+    # Replaced in one transaction so readers never see partial neighbors
+    with transaction.atomic():
+        # Skip the books deleted since the reads were loaded
+        book_ids = set(Book.objects.values_list("id", flat=True))
+        rows = [
+            BookSimilarity(
+                book_id=book_id,
+                similar_id=similar_id,
+                rank=rank,
+                score=score,
+                co_readers=co_readers,
+            )
+            for book_id, similar_id, rank, score, co_readers in similarities
+            if book_id in book_ids and similar_id in book_ids
+        ]
+        BookSimilarity.objects.all().delete()
+        BookSimilarity.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,399 @@
+import html
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from .models import Book, BookPage
+
+# Text search configuration of PostgreSQL (stemming and stop words)
+SEARCH_CONFIG = getattr(settings, "BOOKS_SEARCH_CONFIG", "english")
+# Maximum number of characters of a query
+MAX_QUERY_LENGTH = 200
+
+SEARCH_TABLE = "books_book_search"
+PAGE_SEARCH_TABLE = "books_bookpage_search"
+TOKEN_RE = re.compile(r'"([^"]*)"?|(\S+)')
+WORD_RE = re.compile(r"\w+")
+
+# Highlights are marked with control characters, escaped and then turned into
+# <mark> tags, so that the text of a book is never returned as markup
+MARK_START, MARK_END = "\x02", "\x03"
+
+
+class SearchError(ValueError):
+    pass
+
+
+def parseQuery(query: str) -> list:
+    """
+    Parse a search query into a list of (words, prefix) terms.
+
+    Quoted text is a phrase, a word ending with "*" matches every word that
+    starts with it, and every term must match. Punctuation is ignored.
+    """
+    query = (query or "").strip()
+    if len(query) > MAX_QUERY_LENGTH:
+        raise SearchError(f"Query cannot be longer than {MAX_QUERY_LENGTH} characters")
+    terms = []
+    for phrase, word in TOKEN_RE.findall(query):
+        words = WORD_RE.findall(phrase or word)
+        if words:
+            terms.append((words, not phrase and word.endswith("*")))
+    if not terms:
+        raise SearchError("Query cannot be empty")
+    return terms
+
+
+def markHighlights(text: str) -> str:
+    return (
+        html.escape(text or "")
+        .replace(MARK_START, "<mark>")
+        .replace(MARK_END, "</mark>")
+    )
+
+
+class SQLiteSearch:
+    """
+    Contentless FTS5 tables of the books and of their pages.
+
+    The rowids are the book and page ids. No text is stored, so rows are
+    removed with the "delete" command and the values they were indexed with,
+    read from the book and its pages before they change. The headlines are
+    built in a temporary table from the title and a single page.
+    """
+
+    def create(self, cursor):
+        for table, columns in ((SEARCH_TABLE, "title, body"), (PAGE_SEARCH_TABLE, "body")):
+            # Drop an index created before the tables were contentless
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s", [table])
+            row = cursor.fetchone()
+            if row is not None and "content=''" not in row[0]:
+                cursor.execute(f"DROP TABLE {table}")
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                f"{columns}, content='', tokenize='porter unicode61')"
+            )
+
+    def isIndexed(self, cursor, table: str, rowid: int) -> bool:
+        # Deleting values that were never indexed would corrupt the index
+        cursor.execute(f"SELECT 1 FROM {table}_docsize WHERE id = %s", [rowid])
+        return cursor.fetchone() is not None
+
+    def index(self, cursor, book_id: int, title: str, body: str):
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, body) VALUES (%s, %s, %s)",
+            [book_id, title, body],
+        )
+
+    def remove(self, cursor, book_id: int):
+        if not self.isIndexed(cursor, SEARCH_TABLE, book_id):
+            return
+        book = Book.objects.only("title", "content", "content_br").get(id=book_id)
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, title, body) "
+            "VALUES ('delete', %s, %s, %s)",
+            [book_id, book.title, book.getContent()],
+        )
+
+    def indexPages(self, cursor, pages: list):
+        cursor.executemany(
+            f"INSERT INTO {PAGE_SEARCH_TABLE} (rowid, body) VALUES (%s, %s)",
+            [[page_id, text] for page_id, text in pages],
+        )
+
+    def removePages(self, cursor, book_id: int):
+        for page in BookPage.objects.filter(book_id=book_id).only("content_br"):
+            if self.isIndexed(cursor, PAGE_SEARCH_TABLE, page.id):
+                cursor.execute(
+                    f"INSERT INTO {PAGE_SEARCH_TABLE} ({PAGE_SEARCH_TABLE}, rowid, body) "
+                    "VALUES ('delete', %s, %s)",
+                    [page.id, page.getContent()],
+                )
+
+    def clear(self, cursor):
+        for table in (SEARCH_TABLE, PAGE_SEARCH_TABLE):
+            cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('delete-all')")
+
+    def compile(self, terms: list, any_term: bool = False) -> str:
+        # "a b" is a phrase, "a"* a prefix, terms are joined with AND (or OR)
+        return (" OR " if any_term else " ").join(
+            '"{}"{}'.format(" ".join(words), "*" if prefix else "")
+            for words, prefix in terms
+        )
+
+    def search(self, cursor, terms: list, limit: int, offset: int) -> list:
+        # bm25 is lower for better matches, a title match weighs 10 body matches
+        cursor.execute(
+            f"""
+            SELECT rowid, -bm25({SEARCH_TABLE}, 10.0, 1.0) AS score
+            FROM {SEARCH_TABLE}
+            WHERE {SEARCH_TABLE} MATCH %s
+            ORDER BY score DESC, rowid
+            LIMIT %s OFFSET %s
+            """,
+            [self.compile(terms), limit, offset],
+        )
+        return cursor.fetchall()
+
+    def matchingPages(self, cursor, terms: list, book_ids: list) -> dict:
+        # First page of each book with any of the terms
+        placeholders = ", ".join(["%s"] * len(book_ids))
+        cursor.execute(
+            f"""
+            SELECT page.book_id, page.id
+            FROM books_bookpage page
+            WHERE page.id IN (
+                SELECT rowid FROM {PAGE_SEARCH_TABLE}
+                WHERE {PAGE_SEARCH_TABLE} MATCH %s
+                AND rowid IN (
+                    SELECT id FROM books_bookpage WHERE book_id IN ({placeholders})
+                )
+            )
+            ORDER BY page.book_id, page.number
+            """,
+            [self.compile(terms, any_term=True), *book_ids],
+        )
+        pages = {}
+        for book_id, page_id in cursor.fetchall():
+            pages.setdefault(book_id, page_id)
+        return pages
+
+    def headlines(self, cursor, terms: list, texts: list) -> list:
+        # highlight() and snippet() need an FTS5 row, so use a temporary one
+        table = "temp.books_search_headline"
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+            "USING fts5(title, body, tokenize='porter unicode61')"
+        )
+        for rowid, (title, body) in enumerate(texts):
+            cursor.execute(
+                f"INSERT INTO {table} (rowid, title, body) VALUES (%s, %s, %s)",
+                [rowid, title, body],
+            )
+        cursor.execute(
+            f"""
+            SELECT rowid,
+                   highlight(books_search_headline, 0, %s, %s),
+                   snippet(books_search_headline, 1, %s, %s, '…', 24)
+            FROM {table}
+            WHERE books_search_headline MATCH %s
+            """,
+            [MARK_START, MARK_END] * 2 + [self.compile(terms, any_term=True)],
+        )
+        found = {rowid: (title, snippet) for rowid, title, snippet in cursor.fetchall()}
+        cursor.execute(f"DELETE FROM {table}")
+        return [found.get(rowid, (title, "")) for rowid, (title, _) in enumerate(texts)]
+
+
+class PostgresSearch:
+    # Weighted tsvectors of the books and of their pages, with GIN indexes
+    def create(self, cursor):
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (
+                book_id bigint PRIMARY KEY REFERENCES books_book (id)
+                    ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+                document tsvector NOT NULL
+            )
+            """
+        )
+        # The text was stored too before only the tsvector was kept
+        cursor.execute(
+            f"ALTER TABLE {SEARCH_TABLE} "
+            "DROP COLUMN IF EXISTS title, DROP COLUMN IF EXISTS body"
+        )
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {PAGE_SEARCH_TABLE} (
+                page_id bigint PRIMARY KEY REFERENCES books_bookpage (id)
+                    ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+                document tsvector NOT NULL
+            )
+            """
+        )
+        for table in (SEARCH_TABLE, PAGE_SEARCH_TABLE):
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_document "
+                f"ON {table} USING GIN (document)"
+            )
+
+    def index(self, cursor, book_id: int, title: str, body: str):
+        cursor.execute(
+            f"""
+            INSERT INTO {SEARCH_TABLE} (book_id, document)
+            VALUES (
+                %s,
+                setweight(to_tsvector(%s::regconfig, %s), 'A')
+                || setweight(to_tsvector(%s::regconfig, %s), 'B')
+            )
+            ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document
+            """,
+            [book_id, SEARCH_CONFIG, title, SEARCH_CONFIG, body],
+        )
+
+    def remove(self, cursor, book_id: int):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE book_id = %s", [book_id])
+
+    def indexPages(self, cursor, pages: list):
+        cursor.executemany(
+            f"""
+            INSERT INTO {PAGE_SEARCH_TABLE} (page_id, document)
+            VALUES (%s, to_tsvector(%s::regconfig, %s))
+            ON CONFLICT (page_id) DO UPDATE SET document = EXCLUDED.document
+            """,
+            [[page_id, SEARCH_CONFIG, text] for page_id, text in pages],
+        )
+
+    def removePages(self, cursor, book_id: int):
+        cursor.execute(
+            f"DELETE FROM {PAGE_SEARCH_TABLE} WHERE page_id IN "
+            "(SELECT id FROM books_bookpage WHERE book_id = %s)",
+            [book_id],
+        )
+
+    def clear(self, cursor):
+        cursor.execute(f"TRUNCATE {SEARCH_TABLE}, {PAGE_SEARCH_TABLE}")
+
+    def compile(self, terms: list, any_term: bool = False) -> str:
+        # a <-> b is a phrase, a:* a prefix of the last word, terms are joined
+        # with AND (or OR), like "a b"* in FTS5
+        compiled = []
+        for words, prefix in terms:
+            last = words[-1] + (":*" if prefix else "")
+            compiled.append("({})".format(" <-> ".join(words[:-1] + [last])))
+        return (" | " if any_term else " & ").join(compiled)
+
+    def search(self, cursor, terms: list, limit: int, offset: int) -> list:
+        cursor.execute(
+            f"""
+            SELECT book_id, ts_rank_cd(document, to_tsquery(%s::regconfig, %s)) AS score
+            FROM {SEARCH_TABLE}
+            WHERE document @@ to_tsquery(%s::regconfig, %s)
+            ORDER BY score DESC, book_id
+            LIMIT %s OFFSET %s
+            """,
+            [SEARCH_CONFIG, self.compile(terms)] * 2 + [limit, offset],
+        )
+        return cursor.fetchall()
+
+    def matchingPages(self, cursor, terms: list, book_ids: list) -> dict:
+        # First page of each book with any of the terms
+        cursor.execute(
+            f"""
+            SELECT DISTINCT ON (page.book_id) page.book_id, page.id
+            FROM books_bookpage page
+            JOIN {PAGE_SEARCH_TABLE} s ON s.page_id = page.id
+            WHERE page.book_id = ANY(%s)
+            AND s.document @@ to_tsquery(%s::regconfig, %s)
+            ORDER BY page.book_id, page.number
+            """,
+            [book_ids, SEARCH_CONFIG, self.compile(terms, any_term=True)],
+        )
+        return dict(cursor.fetchall())
+
+    def headlines(self, cursor, terms: list, texts: list) -> list:
+        # ts_headline only reads the title and the page passed to it
+        options = f'StartSel="{MARK_START}", StopSel="{MARK_END}"'
+        cursor.execute(
+            """
+            SELECT ts_headline(%s::regconfig, t.title, query.q, %s),
+                   ts_headline(%s::regconfig, t.body, query.q, %s)
+            FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS t(title, body, n),
+                 to_tsquery(%s::regconfig, %s) AS query(q)
+            ORDER BY t.n
+            """,
+            [SEARCH_CONFIG, f"{options}, HighlightAll=true"]
+            + [SEARCH_CONFIG, f"{options}, MaxWords=30, MinWords=10"]
+            + [[title for title, _ in texts], [body for _, body in texts]]
+            + [SEARCH_CONFIG, self.compile(terms, any_term=True)],
+        )
+        return cursor.fetchall()
+
+
+SEARCH_BACKENDS = {"sqlite": SQLiteSearch, "postgresql": PostgresSearch}
+
+
+def getSearchBackend():
+    backend = SEARCH_BACKENDS.get(connection.vendor)
+    if backend is None:
+        raise SearchError(f"Search is not supported on {connection.vendor}")
+    return backend()
+
+
+def createSearchIndex(**kwargs):
+    # Connected to post_migrate in BooksConfig.ready(), the table is not a model
+    backend = SEARCH_BACKENDS.get(connection.vendor)
+    if backend is not None:
+        with connection.cursor() as cursor:
+            backend().create(cursor)
+
+
+def indexBook(book_id: int, title: str, content: str):
+    with connection.cursor() as cursor:
+        getSearchBackend().index(cursor, book_id, title, content)
+
+
+def removeBook(book_id: int):
+    # Called before the book changes, SQLite needs the values it was indexed with
+    with connection.cursor() as cursor:
+        getSearchBackend().remove(cursor, book_id)
+
+
+def indexPages(pages: list):
+    # Index (page id, text) pairs, used to pick the page a snippet is taken from
+    with connection.cursor() as cursor:
+        getSearchBackend().indexPages(cursor, pages)
+
+
+def removePages(book_id: int):
+    # Called before the pages of a book are deleted
+    with connection.cursor() as cursor:
+        getSearchBackend().removePages(cursor, book_id)
+
+
+def clearSearchIndex():
+    with connection.cursor() as cursor:
+        getSearchBackend().clear(cursor)
+
+
+def searchBooks(query: str, limit: int, offset: int = 0) -> list:
+    """
+    Return up to `limit` matches of a query, best first, as dicts with the
+    book id, the highlighted title, a highlighted snippet of the content and
+    the relevance score.
+
+    The index only holds the words, so the snippet is taken from the first
+    page of each book with a matching word (or its first page), which is the
+    only text decompressed. Raises SearchError when the query is empty or
+    too long.
+    """
+    terms = parseQuery(query)
+    backend = getSearchBackend()
+    with connection.cursor() as cursor:
+        rows = backend.search(cursor, terms, limit, offset)
+        if not rows:
+            return []
+        book_ids = [book_id for book_id, _ in rows]
+        page_ids = backend.matchingPages(cursor, terms, book_ids)
+        titles = dict(Book.objects.filter(id__in=book_ids).values_list("id", "title"))
+        pages = {
+            page.book_id: page.getContent()
+            for page in BookPage.objects.filter(
+                Q(id__in=page_ids.values())
+                | Q(book_id__in=set(book_ids) - page_ids.keys(), number=1)
+            ).only("book_id", "content_br")
+        }
+        headlines = backend.headlines(
+            cursor,
+            terms,
+            [(titles.get(book_id, ""), pages.get(book_id, "")) for book_id in book_ids],
+        )
+    return [
+        {
+            "id": book_id,
+            "title_highlight": markHighlights(title),
+            "snippet": markHighlights(snippet),
+            "score": round(float(score), 6),
+        }
+        for (book_id, score), (title, snippet) in zip(rows, headlines)
+    ]
@@ -0,0 +1,115 @@
+from django.db import connection, transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from .autocomplete import titleIndex
+from .cache import invalidate, invalidateBook, invalidateCommentLikes
+from .models import Book, Comment, Rating
+from .pages import paginateBook
+from .search import SEARCH_BACKENDS, indexBook, removeBook, removePages
+
+
+@receiver([post_save, post_delete], sender=Book)
+def invalidateBookCache(sender, instance, **kwargs):
+    invalidateBook(instance.id)
+
+
+@receiver(post_save, sender=Book)
+def paginateSavedBook(sender, instance, update_fields, raw, **kwargs):
+    # Split the content into pages again whenever it may have changed
+    if raw:
+        return
+    if update_fields is None or "content_br" in update_fields:
+        paginateBook(instance, instance.getContent())
+
+
+def changesSearchIndex(update_fields, raw) -> bool:
+    # Whether a saved book may have a new title or content to index
+    if raw or connection.vendor not in SEARCH_BACKENDS:
+        return False
+    return update_fields is None or bool(
+        {"title", "content", "content_br"} & set(update_fields)
+    )
+
+
+@receiver(pre_save, sender=Book)
+def unindexChangedBook(sender, instance, update_fields, raw, **kwargs):
+    # Remove the indexed words while the previous title and content are saved
+    if instance.pk is not None and changesSearchIndex(update_fields, raw):
+        removeBook(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def indexSavedBook(sender, instance, update_fields, raw, **kwargs):
+    # The pages are indexed by paginateBook
+    if changesSearchIndex(update_fields, raw):
+        indexBook(instance.id, instance.title, instance.getContent())
+
+
+@receiver(pre_delete, sender=Book)
+def unindexDeletedBook(sender, instance, **kwargs):
+    if connection.vendor in SEARCH_BACKENDS:
+        removeBook(instance.id)
+        removePages(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Rating)
+def invalidateRatedBookCache(sender, instance, **kwargs):
+    invalidateBook(instance.book_id)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidateCommentedBookCache(sender, instance, **kwargs):
+    invalidateBook(instance.book_id)
+    # Versions of the comment lists, used as their ETags
+    invalidate(f"comments:{instance.book_id}", f"thread:{instance.book_id}")
+    if instance.parent_comment_id is not None:
+        invalidate(f"replies:{instance.parent_comment_id}")
+        # The parent is itself listed with its reply count among the replies
+        # of its own parent
+        grandparent_id = (
+            Comment.objects.filter(id=instance.parent_comment_id)
+            .values_list("parent_comment_id", flat=True)
+            .first()
+        )
+        if grandparent_id is not None:
+            invalidate(f"replies:{grandparent_id}")
+
+
+@receiver(m2m_changed, sender=Comment.likes.through)
+def invalidateLikedComments(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    # From a user (reverse) the changed comments are in pk_set
+    if not reverse:
+        comments = [instance]
+    elif pk_set is not None:
+        comments = Comment.objects.filter(pk__in=pk_set).only(
+            "book_id", "parent_comment_id"
+        )
+    else:
+        # post_clear from a user does not say which comments were unliked
+        comments = []
+    for comment in comments:
+        invalidateCommentLikes(comment.pk, comment.book_id, comment.parent_comment_id)
+
+
+@receiver(post_save, sender=Book)
+def indexSavedTitle(sender, instance, created, update_fields, raw, **kwargs):
+    # Update the autocomplete index once the new title is committed
+    if raw:
+        return
+    if created or update_fields is None or "title" in update_fields:
+        book_id, title = instance.id, instance.title
+        transaction.on_commit(lambda: titleIndex.update(book_id, title))
+
+
+@receiver(post_delete, sender=Book)
+def unindexDeletedTitle(sender, instance, **kwargs):
+    book_id = instance.id
+    transaction.on_commit(lambda: titleIndex.update(book_id))
@@ -0,0 +1,47 @@
+import hashlib
+import posixpath
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.module_loading import import_string
+
+
+def hashFile(file) -> str:
+    # SHA-256 of a Django File, read in chunks and rewound for the caller
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def contentAddressedName(name: str, digest: str) -> str:
+    # "book_covers/cover.PNG" -> "book_covers/ab/ab12...ef.png"
+    directory = posixpath.dirname(name)
+    extension = posixpath.splitext(name)[1].lower()
+    return posixpath.join(directory, digest[:2], digest + extension)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage naming each file after the SHA-256 of its content.
+
+    Saving a file that is already stored returns the existing name without
+    writing anything, so identical covers are kept once whichever book or
+    title they are uploaded for.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = contentAddressedName(name, hashFile(content))
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+def getCoverStorage():
+    # The storage class is set by the BOOKS_COVER_STORAGE setting
+    path = getattr(
+        settings, "BOOKS_COVER_STORAGE", "books.storage.ContentAddressedStorage"
+    )
+    return import_string(path)()
@@ -0,0 +1,290 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .cache import invalidate, invalidateBook
+from .models import Book, Comment, Rating, ReadBook
+from .readbuffer import writeReads
+
+# Most operations a sync request can contain
+MAX_SYNC_OPERATIONS = getattr(settings, "SYNC_MAX_OPERATIONS", 500)
+
+
+class SyncError(ValueError):
+    pass
+
+
+def addToCounters(model, deltas: dict):
+    """
+    Add deltas to counter columns of several rows in one UPDATE statement.
+
+    `deltas` maps a primary key to a dictionary of field name to the amount
+    added to it, e.g. {1: {"rating_sum": 4, "rating_count": 1}}.
+    """
+    fields = {field for changes in deltas.values() for field in changes}
+    if not fields:
+        return
+    objects = []
+    for pk, changes in deltas.items():
+        obj = model(pk=pk)
+        # bulk_update writes every field of every row, so unchanged ones add 0
+        for field in fields:
+            setattr(obj, field, F(field) + changes.get(field, 0))
+        objects.append(obj)
+    model.objects.bulk_update(objects, list(fields))
+
+
+def applyRatings(user, ratings: dict) -> dict:
+    """
+    Add or replace the ratings of a user, given as {book_id: stars}.
+
+    Returns {book_id: (rating_id, created)} for the books that exist. The
+    ratings are upserted in one statement and the book aggregates adjusted by
+    the difference with the previous ratings.
+    """
+    with transaction.atomic():
+        # Lock the books, whose counters are updated below anyway, so that the
+        # previous ratings read here cannot change before the upsert
+        book_ids = list(
+            Book.objects.select_for_update()
+            .filter(id__in=ratings)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        if not book_ids:
+            return {}
+        previous = {
+            book_id: (rating_id, stars)
+            for rating_id, book_id, stars in Rating.objects.filter(
+                user=user, book_id__in=book_ids
+            ).values_list("id", "book_id", "rating")
+        }
+
+        # Insert the ratings, or update them if the user already rated the book
+        Rating.objects.bulk_create(
+            [
+                Rating(user=user, book_id=book_id, rating=ratings[book_id])
+                for book_id in book_ids
+            ],
+            update_conflicts=True,
+            unique_fields=["user", "book"],
+            update_fields=["rating"],
+        )
+
+        deltas = {}
+        for book_id in book_ids:
+            stars = ratings[book_id]
+            if book_id not in previous:
+                deltas[book_id] = {
+                    "rating_sum": stars,
+                    "rating_count": 1,
+                    f"rating_{stars}": 1,
+                }
+                continue
+            previous_stars = previous[book_id][1]
+            deltas[book_id] = {"rating_sum": stars - previous_stars}
+            if previous_stars != stars:
+                deltas[book_id][f"rating_{stars}"] = 1
+                deltas[book_id][f"rating_{previous_stars}"] = -1
+        addToCounters(Book, deltas)
+
+        created = Rating.objects.filter(
+            user=user, book_id__in=[id for id in book_ids if id not in previous]
+        ).values_list("book_id", "id")
+        results = {book_id: (rating_id, True) for book_id, rating_id in created}
+        for book_id, (rating_id, _) in previous.items():
+            results[book_id] = (rating_id, False)
+
+    # The upsert does not send the Rating signals
+    for book_id in book_ids:
+        invalidateBook(book_id)
+    return results
+
+
+def applyComments(user, comments: list) -> list:
+    """
+    Create comments and replies given as Comment instances without a user.
+
+    The comments are inserted in one statement and the counters of their
+    books and parent comments updated in two more.
+    """
+    for comment in comments:
+        comment.user = user
+    with transaction.atomic():
+        comments = Comment.objects.bulk_create(comments)
+
+        book_deltas = {}
+        reply_deltas = {}
+        for comment in comments:
+            deltas = book_deltas.setdefault(comment.book_id, {})
+            deltas["total_comment_count"] = deltas.get("total_comment_count", 0) + 1
+            if comment.parent_comment_id is None:
+                deltas["comment_count"] = deltas.get("comment_count", 0) + 1
+            else:
+                deltas = reply_deltas.setdefault(comment.parent_comment_id, {})
+                deltas["reply_count"] = deltas.get("reply_count", 0) + 1
+        addToCounters(Book, book_deltas)
+        addToCounters(Comment, reply_deltas)
+
+    # bulk_create does not send the Comment signals
+    for book_id in book_deltas:
+        invalidateBook(book_id)
+        invalidate(f"comments:{book_id}", f"thread:{book_id}")
+    if reply_deltas:
+        # The parents are listed with their reply counts under their own parents
+        grandparent_ids = set(
+            Comment.objects.filter(
+                id__in=reply_deltas, parent_comment__isnull=False
+            ).values_list("parent_comment_id", flat=True)
+        )
+        invalidate(
+            *[f"replies:{id}" for id in reply_deltas.keys() | grandparent_ids]
+        )
+    return comments
+
+
+def getId(item: dict, key: str):
+    # An id given in a sync operation, None unless it is an integer
+    value = item.get(key)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def applySync(user, data: dict) -> dict:
+    """
+    Validate and apply the ratings, comments and reads of an offline client.
+
+    Every operation gets a result at the same position as in the request,
+    invalid operations are reported and skipped without failing the others.
+    Raises SyncError when the request itself is malformed.
+    """
+    operations = {}
+    for kind in ("ratings", "comments", "reads"):
+        items = data.get(kind, [])
+        if not isinstance(items, list) or not all(
+            isinstance(item, dict) for item in items
+        ):
+            raise SyncError(f"{kind} must be a list of objects")
+        operations[kind] = items
+    if sum(len(items) for items in operations.values()) > MAX_SYNC_OPERATIONS:
+        raise SyncError(
+            f"At most {MAX_SYNC_OPERATIONS} operations can be synced at once"
+        )
+
+    with transaction.atomic():
+        # Look up every referenced book and parent comment at once, locking
+        # them so they cannot be deleted before the operations are applied
+        book_ids = {
+            getId(item, "book") for items in operations.values() for item in items
+        }
+        books = set(
+            Book.objects.select_for_update()
+            .filter(id__in=book_ids - {None})
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        parent_ids = {getId(item, "parent") for item in operations["comments"]}
+        parents = dict(
+            Comment.objects.select_for_update()
+            .filter(id__in=parent_ids - {None})
+            .order_by("id")
+            .values_list("id", "book_id")
+        )
+
+        results = {kind: [None] * len(items) for kind, items in operations.items()}
+
+        def fail(kind: str, index: int, message: str):
+            results[kind][index] = {"status": "error", "message": message}
+
+        # Operations on the same book are applied in order, like separate requests
+        ratings = {}
+        for index, item in enumerate(operations["ratings"]):
+            book_id = getId(item, "book")
+            stars = getId(item, "rating")
+            if book_id not in books:
+                fail("ratings", index, "Book not found")
+            elif stars is None or not 1 <= stars <= 5:
+                fail("ratings", index, "Rating must be between 1 and 5")
+            else:
+                ratings.setdefault(book_id, []).append((index, stars))
+
+        comments = []
+        for index, item in enumerate(operations["comments"]):
+            book_id = getId(item, "book")
+            content = item.get("content")
+            parent_id = getId(item, "parent")
+            if book_id not in books:
+                fail("comments", index, "Book not found")
+            elif not isinstance(content, str) or not content.strip():
+                fail("comments", index, "Content cannot be empty")
+            elif item.get("parent") is not None and parents.get(parent_id) != book_id:
+                fail("comments", index, "Comment not found")
+            else:
+                comment = Comment(
+                    book_id=book_id, content=content, parent_comment_id=parent_id
+                )
+                comments.append((index, comment))
+
+        now = timezone.now()
+        reads = {}
+        for index, item in enumerate(operations["reads"]):
+            book_id = getId(item, "book")
+            try:
+                read_date = parse_datetime(item.get("read_date") or now.isoformat())
+            except (TypeError, ValueError):
+                read_date = None
+            if book_id not in books:
+                fail("reads", index, "Book not found")
+            elif read_date is None:
+                fail("reads", index, "Invalid read_date")
+            else:
+                if timezone.is_naive(read_date):
+                    read_date = timezone.make_aware(read_date)
+                reads.setdefault(book_id, []).append((index, min(read_date, now)))
+
+        if ratings:
+            # The last rating of a book is the one kept
+            applied = applyRatings(
+                user, {book_id: items[-1][1] for book_id, items in ratings.items()}
+            )
+            for book_id, items in ratings.items():
+                rating_id, created = applied[book_id]
+                for position, (index, stars) in enumerate(items):
+                    results["ratings"][index] = {
+                        "status": "created" if created and position == 0 else "updated",
+                        "id": rating_id,
+                        "rating": stars,
+                    }
+
+        if comments:
+            created = applyComments(user, [comment for _, comment in comments])
+            for (index, _), comment in zip(comments, created):
+                results["comments"][index] = {"status": "created", "id": comment.id}
+
+        if reads:
+            already_read = set(
+                ReadBook.objects.filter(user=user, book_id__in=reads).values_list(
+                    "book_id", flat=True
+                )
+            )
+            # The first time a book was read offline is kept
+            writeReads(
+                [
+                    ReadBook(
+                        user=user,
+                        book_id=book_id,
+                        read_date=min(read_date for _, read_date in items),
+                    )
+                    for book_id, items in reads.items()
+                    if book_id not in already_read
+                ]
+            )
+            for book_id, items in reads.items():
+                for position, (index, _) in enumerate(items):
+                    created = book_id not in already_read and position == 0
+                    results["reads"][index] = {
+                        "status": "created" if created else "already_read"
+                    }
+    return results
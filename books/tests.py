@@ -1,12 +1,48 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import Book, Comment, Rating
+from .autocomplete import editDistance, titleIndex
+from .cache import bumpVersion, getCacheStats, getVersion
+from .compression import acceptsBrotli, decompressText
+from . import imaging
+from .imagehost import ImageHost, LocalImageHost, getImageHost
+from .imaging import DERIVATIVE_SIZES, renderDerivatives
+from .jobs import requeueLostJobs, runPendingJobs
+from .models import Book, BookSimilarity, Comment, Job, Rating, ReadBook
+from .pages import splitContent
+from .readbuffer import ReadBuffer, readBuffer
+from .recommendations import refreshSimilarities
+from .search import PostgresSearch, SQLiteSearch, parseQuery
 
 # Create your tests here.
 
+
+def isolateReadBuffer(test):
+    # The read buffer is shared by the process, give each test an empty one
+    readBuffer.discard()
+    test.addCleanup(readBuffer.discard)
+
+
 class BookModelTest(TestCase):
     
     def setUp(self):
@@ -132,9 +168,103 @@ class ListBooksViewTestCase(TestCase):
                 self.assertEqual(book["published_by"]["username"], self.user.username)
                 self.assertEqual(book["published_by"]["email"], self.user.email)
 
+    def test_list_books_aggregates(self):
+        book = Book.objects.create(
+            title="Book 1",
+            content="Content 1",
+            published_by=self.user
+        )
+        other_user = User.objects.create_user(
+            username="otheruser",
+            password="otherpassword"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.client.post(reverse("add_rating", args=[book.id]), {"rating": 5})
+        response = self.client.post(
+            reverse("add_comment", args=[book.id]), {"content": "Comment"}
+        )
+        self.client.force_authenticate(user=other_user)
+        self.client.post(reverse("add_rating", args=[book.id]), {"rating": 2})
+        self.client.post(
+            reverse("reply_comment", args=[response.data["id"]]), {"content": "Reply"}
+        )
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.data[0]["average_rating"], 3.5)
+        self.assertEqual(response.data[0]["total_ratings"], 2)
+        self.assertEqual(response.data[0]["total_comments"], 2)
+
+    def test_list_books_query_budget(self):
+        # The catalog must be served with the same number of queries
+        # no matter how many books, ratings and comments exist
+        for i in range(10):
+            book = Book.objects.create(
+                title=f"Book {i}",
+                content=f"Content {i}",
+                published_by=self.user
+            )
+            Rating.objects.create(user=self.user, book=book, rating=4)
+            Comment.objects.create(book=book, user=self.user, content="Comment")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 10)
+
+
+class ListBooksPaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse("book_list")
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        for i in range(5):
+            Book.objects.create(
+                title=f"Book {i}",
+                content=f"Content {i}",
+                published_by=self.user
+            )
+
+    def test_walk_pages(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            seen += [book["id"] for book in response.data["results"]]
+            cursor = response.data["next_cursor"]
+            if cursor is None:
+                break
+
+        # Every book is listed once, in the catalog order
+        expected = list(
+            Book.objects.order_by("-date_published", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_content_is_opt_in(self):
+        response = self.client.get(self.url, {"limit": 2})
+        self.assertNotIn("content", response.data["results"][0])
+
+        response = self.client.get(self.url, {"limit": 2, "include_content": "true"})
+        self.assertIn("content", response.data["results"][0])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class BookViewTestCase(TestCase):
     def setUp(self):
+        isolateReadBuffer(self)
         self.client = APIClient()
         
         # Create a test user
@@ -167,9 +297,18 @@ class BookViewTestCase(TestCase):
         # Check if the response data contains the book details
         self.assertEqual(response.data["id"], book.id)
         self.assertEqual(response.data["title"], book.title)
-        self.assertEqual(response.data["content"], book.content)
         self.assertEqual(response.data["published_by"]["username"], self.user.username)
-        # Add more assertions for other book details if needed
+        # The content is read by page, the details only list the pages
+        self.assertNotIn("content", response.data)
+        self.assertEqual(response.data["page_count"], 1)
+        self.assertEqual(
+            response.data["table_of_contents"],
+            [{"page": 1, "heading": "Content 1", "length": len(book.content)}],
+        )
+
+        # The whole content can still be asked for
+        response = self.client.get(self.url, {"include_content": "true"})
+        self.assertEqual(response.data["content"], book.content)
 
     def test_get_book_details_unauthenticated(self):
         # Make a GET request to view book details without authentication
@@ -182,7 +321,7 @@ class BookViewTestCase(TestCase):
         book = Book.objects.get(id=1)
         self.assertEqual(response.data["id"], book.id)
         self.assertEqual(response.data["title"], book.title)
-        self.assertEqual(response.data["content"], book.content)
+        self.assertEqual(response.data["page_count"], book.page_count)
         self.assertEqual(response.data["published_by"]["username"], self.user.username)
 
 
@@ -346,4 +485,1331 @@ class AddRatingViewTestCase(TestCase):
         response = self.client.post(self.url, data, format="multipart")
 
         # Check if the response status code is 401 Unauthorized
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class BookCountersTestCase(TestCase):
+    def setUp(self):
+        isolateReadBuffer(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            content="Test Content",
+            published_by=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_rating_counters(self):
+        url = reverse("add_rating", args=[self.book.id])
+        response = self.client.post(url, {"rating": 5})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(url, {"rating": 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.rating_sum, 3)
+        self.assertEqual(self.book.rating_count, 1)
+        self.assertEqual(
+            self.book.rating_histogram, {"1": 0, "2": 0, "3": 1, "4": 0, "5": 0}
+        )
+        self.assertEqual(Rating.objects.get(book=self.book).rating, 3)
+
+        other_user = User.objects.create_user(username="other", password="password")
+        self.client.force_authenticate(user=other_user)
+        self.client.post(url, {"rating": 5})
+        self.client.post(url, {"rating": 5})
+
+        response = self.client.get(reverse("book_detail", args=[self.book.id]))
+        self.assertEqual(response.data["average_rating"], 4)
+        self.assertEqual(response.data["total_ratings"], 2)
+        self.assertEqual(response.data["rating_histogram"]["5"], 1)
+
+        response = self.client.post(url, {"rating": "five"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_one_rating_per_user(self):
+        Rating.objects.create(user=self.user, book=self.book, rating=4)
+        with self.assertRaises(IntegrityError):
+            Rating.objects.create(user=self.user, book=self.book, rating=2)
+
+    def test_comment_counters(self):
+        response = self.client.post(
+            reverse("add_comment", args=[self.book.id]), {"content": "Comment"}
+        )
+        comment_id = response.data["id"]
+        self.client.post(reverse("reply_comment", args=[comment_id]), {"content": "A"})
+        response = self.client.post(
+            reverse("reply_comment", args=[comment_id]), {"content": "B"}
+        )
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.comment_count, 1)
+        self.assertEqual(self.book.total_comment_count, 3)
+        self.assertEqual(Comment.objects.get(id=comment_id).reply_count, 2)
+
+        self.client.delete(reverse("delete_comment", args=[response.data["id"]]))
+        self.assertEqual(Comment.objects.get(id=comment_id).reply_count, 1)
+
+        # Deleting the comment also deletes its replies
+        self.client.delete(reverse("delete_comment", args=[comment_id]))
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.comment_count, 0)
+        self.assertEqual(self.book.total_comment_count, 0)
+
+    def test_reader_counter(self):
+        url = reverse("book_detail", args=[self.book.id])
+        self.client.get(url)
+        self.client.get(url)
+        readBuffer.flush()
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.reader_count, 1)
+
+    def test_recount_book_stats(self):
+        # Rows created outside of the views leave the counters stale
+        comment = Comment.objects.create(book=self.book, user=self.user, content="A")
+        Comment.objects.create(
+            book=self.book, user=self.user, content="B", parent_comment=comment
+        )
+        Rating.objects.create(user=self.user, book=self.book, rating=4)
+        ReadBook.objects.create(
+            user=self.user, book=self.book, read_date="2023-10-01T00:00Z"
+        )
+
+        out = StringIO()
+        call_command("recount_book_stats", stdout=out)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.rating_sum, 4)
+        self.assertEqual(self.book.rating_count, 1)
+        self.assertEqual(self.book.rating_4, 1)
+        self.assertEqual(self.book.comment_count, 1)
+        self.assertEqual(self.book.total_comment_count, 2)
+        self.assertEqual(self.book.reader_count, 1)
+        self.assertEqual(Comment.objects.get(id=comment.id).reply_count, 1)
+        self.assertIn("Checked 1 books, repaired 1", out.getvalue())
+        self.assertIn("Checked 2 comments, repaired 1", out.getvalue())
+
+
+class ReadBufferTestCase(TestCase):
+    def setUp(self):
+        isolateReadBuffer(self)
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            content="Test Content",
+            published_by=self.user
+        )
+        self.buffer = ReadBuffer(batch_size=3, max_age=60)
+
+    def test_book_view_does_not_write(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+
+        client.get(reverse("book_detail", args=[self.book.id]))
+
+        self.assertFalse(ReadBook.objects.exists())
+        self.assertEqual(len(readBuffer), 1)
+
+    def test_events_are_coalesced(self):
+        self.buffer.record(self.user.id, self.book.id)
+        self.buffer.record(self.user.id, self.book.id)
+        self.assertEqual(len(self.buffer), 1)
+        self.assertFalse(self.buffer.isDue())
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(ReadBook.objects.count(), 1)
+
+        # A book already read is not recorded nor counted twice
+        self.buffer.record(self.user.id, self.book.id)
+        self.buffer.flush()
+        self.book.refresh_from_db()
+        self.assertEqual(ReadBook.objects.count(), 1)
+        self.assertEqual(self.book.reader_count, 1)
+
+    def test_flush_adds_new_readers_to_counters(self):
+        other_book = Book.objects.create(title="Other Book", published_by=self.user)
+        readers = [
+            User.objects.create_user(username=f"reader{i}", password="pass")
+            for i in range(3)
+        ]
+        self.buffer.record(readers[0].id, self.book.id)
+        self.buffer.flush()
+
+        # Only the pairs not read before are added, without recounting the book
+        for reader in readers:
+            self.buffer.record(reader.id, self.book.id)
+        self.buffer.record(readers[0].id, other_book.id)
+        with self.assertNumQueries(7):
+            self.buffer.flush()
+        self.book.refresh_from_db()
+        other_book.refresh_from_db()
+        self.assertEqual(self.book.reader_count, 3)
+        self.assertEqual(other_book.reader_count, 1)
+
+    def test_flush_when_full(self):
+        for i in range(3):
+            user = User.objects.create_user(username=f"reader{i}", password="pass")
+            self.buffer.record(user.id, self.book.id)
+        self.assertTrue(self.buffer.isDue())
+
+    def test_failed_flush_keeps_events(self):
+        self.buffer.record(self.user.id, self.book.id)
+        first_read = self.buffer._events[self.user.id, self.book.id]
+        with mock.patch(
+            "books.readbuffer.writeReads", side_effect=DatabaseError
+        ), self.assertLogs("books.readbuffer", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 1)
+
+        # The first read date is kept when the book is read again meanwhile
+        self.buffer.record(self.user.id, self.book.id)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(ReadBook.objects.get().read_date, first_read)
+
+    def test_failed_flush_retries_are_capped(self):
+        buffer = ReadBuffer(batch_size=3, max_age=60, max_retries=1)
+        buffer.record(self.user.id, self.book.id)
+        with mock.patch(
+            "books.readbuffer.writeReads", side_effect=DatabaseError
+        ), self.assertLogs("books.readbuffer", "ERROR") as logs:
+            buffer.flush()
+            self.assertEqual(len(buffer), 1)
+            buffer.flush()
+        self.assertEqual(len(buffer), 0)
+        self.assertIn("Dropped 1 read events", logs.output[-1])
+
+    def test_deleted_book_is_dropped(self):
+        other = Book.objects.create(
+            title="Deleted", content="Deleted", published_by=self.user
+        )
+        self.buffer.record(self.user.id, other.id)
+        self.buffer.record(self.user.id, self.book.id)
+        other.delete()
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(ReadBook.objects.get().book_id, self.book.id)
+
+
+class BookCacheTestCase(TestCase):
+    def setUp(self):
+        isolateReadBuffer(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            content="Test Content",
+            published_by=self.user
+        )
+
+    def test_catalog_is_cached(self):
+        url = reverse("book_list")
+        self.client.get(url)
+        hits = getCacheStats()["hits"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertEqual(response.data[0]["title"], "Test Book")
+        self.assertEqual(getCacheStats()["hits"], hits + 1)
+
+    def test_rating_invalidates_book_and_catalog(self):
+        self.client.force_authenticate(user=self.user)
+        detail_url = reverse("book_detail", args=[self.book.id])
+        self.client.get(reverse("book_list"))
+        self.client.get(detail_url)
+
+        self.client.post(reverse("add_rating", args=[self.book.id]), {"rating": 4})
+
+        response = self.client.get(detail_url)
+        self.assertEqual(response.data["average_rating"], 4)
+        response = self.client.get(reverse("book_list"))
+        self.assertEqual(response.data[0]["total_ratings"], 1)
+
+    def test_update_invalidates_book(self):
+        admin = User.objects.create_user(
+            username="adminuser", password="adminpassword", is_staff=True
+        )
+        self.client.force_authenticate(user=admin)
+        detail_url = reverse("book_detail", args=[self.book.id])
+        self.client.get(detail_url)
+
+        self.client.patch(
+            reverse("admin-books-edit", args=[self.book.id]),
+            {"title": "New Title"},
+            format="multipart",
+        )
+
+        response = self.client.get(detail_url)
+        self.assertEqual(response.data["title"], "New Title")
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        isolateReadBuffer(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            content="Test Content",
+            published_by=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_catalog_not_modified(self):
+        url = reverse("book_list")
+        response = self.client.get(url)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+        # Another representation of the catalog has its own ETag
+        response = self.client.get(url, {"limit": 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_book_detail_not_modified(self):
+        url = reverse("book_detail", args=[self.book.id])
+        etag = self.client.get(url)["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post(reverse("add_rating", args=[self.book.id]), {"rating": 3})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_comment_lists_not_modified(self):
+        url = reverse("list_comments", args=[self.book.id])
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.post(
+            reverse("add_comment", args=[self.book.id]), {"content": "Comment"}
+        )
+        comment_id = response.data["id"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        url = reverse("list_replies", args=[comment_id])
+        etag = self.client.get(url)["ETag"]
+        self.client.post(reverse("reply_comment", args=[comment_id]), {"content": "A"})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        url = reverse("get_comment_likes", args=[comment_id])
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.post(reverse("like_comment", args=[comment_id]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["like_count"], 1)
+
+    def test_nested_reply_changes_grandparent_replies(self):
+        comment = Comment.objects.create(
+            book=self.book, user=self.user, content="Comment"
+        )
+        response = self.client.post(
+            reverse("reply_comment", args=[comment.id]), {"content": "Reply"}
+        )
+        reply_id = response.data["id"]
+        url = reverse("list_replies", args=[comment.id])
+        etag = self.client.get(url)["ETag"]
+
+        # The reply is listed with its own reply count
+        response = self.client.post(
+            reverse("reply_comment", args=[reply_id]), {"content": "Nested"}
+        )
+        nested_id = response.data["id"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["replies"][0]["reply_count"], 1)
+
+        etag = response["ETag"]
+        self.client.delete(reverse("delete_comment", args=[nested_id]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["replies"][0]["reply_count"], 0)
+
+    def test_any_etag_only_matches_existing_resources(self):
+        comment = Comment.objects.create(
+            book=self.book, user=self.user, content="Comment"
+        )
+        for name, existing, missing in (
+            ("book_detail", self.book.id, 999),
+            ("book_content", self.book.id, 999),
+            ("list_comments", self.book.id, 999),
+            ("list_replies", comment.id, 999),
+            ("get_comment_likes", comment.id, 999),
+        ):
+            response = self.client.get(
+                reverse(name, args=[missing]), HTTP_IF_NONE_MATCH="*"
+            )
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, name)
+            response = self.client.get(
+                reverse(name, args=[existing]), HTTP_IF_NONE_MATCH="*"
+            )
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, name)
+
+        response = self.client.get(reverse("book_list"), HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class CommentListPaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            content="Test Content",
+            published_by=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+        for i in range(5):
+            self.client.post(
+                reverse("add_comment", args=[self.book.id]), {"content": f"Comment {i}"}
+            )
+        self.comment = Comment.objects.order_by("id").first()
+        for i in range(3):
+            self.client.post(
+                reverse("reply_comment", args=[self.comment.id]), {"content": f"Reply {i}"}
+            )
+        self.client.put(reverse("like_comment", args=[self.comment.id]))
+
+    def test_paginate_comments(self):
+        url = reverse("list_comments", args=[self.book.id])
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["comment_count"], 5)
+        first, second = response.data["comments"]
+        self.assertEqual((first["reply_count"], first["like_count"]), (3, 1))
+        self.assertTrue(first["liked_by_me"])
+        self.assertFalse(second["liked_by_me"])
+
+        contents = [comment["content"] for comment in response.data["comments"]]
+        cursor = response.data["next_cursor"]
+        while cursor:
+            response = self.client.get(url, {"limit": 2, "cursor": cursor})
+            contents += [comment["content"] for comment in response.data["comments"]]
+            cursor = response.data["next_cursor"]
+        self.assertEqual(contents, [f"Comment {i}" for i in range(5)])
+
+    def test_unpaginated_lists_return_everything(self):
+        response = self.client.get(reverse("list_comments", args=[self.book.id]))
+        self.assertEqual(len(response.data["comments"]), 5)
+        self.assertIsNone(response.data["next_cursor"])
+        response = self.client.get(reverse("list_replies", args=[self.comment.id]))
+        self.assertEqual(
+            [reply["content"] for reply in response.data["replies"]],
+            ["Reply 0", "Reply 1", "Reply 2"],
+        )
+
+    def test_paginate_replies(self):
+        url = reverse("list_replies", args=[self.comment.id])
+        response = self.client.get(url, {"limit": 2})
+        self.assertEqual(response.data["reply_count"], 3)
+        self.assertEqual(len(response.data["replies"]), 2)
+
+        response = self.client.get(url, {"cursor": response.data["next_cursor"]})
+        self.assertEqual(
+            [reply["content"] for reply in response.data["replies"]], ["Reply 2"]
+        )
+        self.assertIsNone(response.data["next_cursor"])
+
+        response = self.client.get(url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_like_changes_comment_list(self):
+        url = reverse("list_comments", args=[self.book.id])
+        etag = self.client.get(url)["ETag"]
+        self.client.delete(reverse("like_comment", args=[self.comment.id]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["comments"][0]["like_count"], 0)
+
+        # liked_by_me differs between users
+        other_user = User.objects.create_user(username="other", password="password")
+        self.client.force_authenticate(user=other_user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_like_comment(self):
+        url = reverse("like_comment", args=[self.comment.id])
+        # Liking twice keeps a single like
+        response = self.client.put(url)
+        self.assertEqual((response.data["liked"], response.data["like_count"]), (True, 1))
+
+        other_user = User.objects.create_user(username="other", password="password")
+        self.client.force_authenticate(user=other_user)
+        response = self.client.post(url)
+        self.assertEqual((response.data["liked"], response.data["like_count"]), (True, 2))
+        response = self.client.post(url)
+        self.assertEqual((response.data["liked"], response.data["like_count"]), (False, 1))
+        response = self.client.delete(url)
+        self.assertEqual((response.data["liked"], response.data["like_count"]), (False, 1))
+
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.like_count, 1)
+        self.assertEqual(list(self.comment.likes.all()), [self.user])
+
+
+class CommentLikesViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="password")
+            for i in range(5)
+        ]
+        self.book = Book.objects.create(
+            title="Test Book",
+            content="Test Content",
+            published_by=self.users[0]
+        )
+        self.comment = Comment.objects.create(
+            book=self.book, user=self.users[0], content="Comment"
+        )
+        self.url = reverse("get_comment_likes", args=[self.comment.id])
+        for user in self.users:
+            self.client.force_authenticate(user=user)
+            self.client.put(reverse("like_comment", args=[self.comment.id]))
+
+    def test_count_only(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"count_only": "true"})
+        self.assertEqual(response.data, {"like_count": 5})
+
+    def test_paginate_likes(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {"limit": 3})
+        self.assertEqual(response.data["like_count"], 5)
+        # The most recent likes come first
+        usernames = [like["username"] for like in response.data["likes"]]
+        self.assertEqual(usernames, ["user4", "user3", "user2"])
+
+        response = self.client.get(
+            self.url, {"limit": 3, "cursor": response.data["next_cursor"]}
+        )
+        usernames = [like["username"] for like in response.data["likes"]]
+        self.assertEqual(usernames, ["user1", "user0"])
+        self.assertIsNone(response.data["next_cursor"])
+
+
+class CommentThreadViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            content="Test Content",
+            published_by=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+
+        # Two top-level comments, the first with two levels of replies
+        self.first = Comment.objects.create(book=self.book, user=self.user, content="1")
+        self.reply = Comment.objects.create(
+            book=self.book, user=self.user, content="1.1", parent_comment=self.first
+        )
+        Comment.objects.create(
+            book=self.book, user=self.user, content="1.1.1", parent_comment=self.reply
+        )
+        Comment.objects.create(book=self.book, user=self.user, content="2")
+        # The thread reads the reply and comment counters
+        call_command("recount_book_stats", stdout=StringIO())
+        self.client.put(reverse("like_comment", args=[self.reply.id]))
+        self.url = reverse("comment_thread", args=[self.book.id])
+
+    def test_comment_thread(self):
+        # The book, the top-level comments and one query per level of replies
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["comment_count"], 4)
+
+        first, second = response.data["comments"]
+        self.assertEqual(first["content"], "1")
+        self.assertEqual(first["reply_count"], 1)
+        self.assertEqual(first["user"]["username"], self.user.username)
+        reply = first["replies"][0]
+        self.assertEqual((reply["content"], reply["like_count"]), ("1.1", 1))
+        self.assertTrue(reply["liked_by_me"])
+        self.assertFalse(first["liked_by_me"])
+        self.assertEqual(reply["replies"][0]["content"], "1.1.1")
+        self.assertEqual(second["replies"], [])
+
+    def test_comment_thread_depth(self):
+        response = self.client.get(self.url, {"depth": 2})
+        reply = response.data["comments"][0]["replies"][0]
+        self.assertEqual(reply["reply_count"], 1)
+        self.assertNotIn("replies", reply)
+
+        response = self.client.get(self.url, {"depth": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_comment_thread_pages(self):
+        response = self.client.get(self.url, {"limit": 1})
+        self.assertEqual(
+            [comment["content"] for comment in response.data["comments"]], ["1"]
+        )
+        self.assertEqual(response.data["comments"][0]["replies"][0]["content"], "1.1")
+        self.assertEqual(response.data["comment_count"], 4)
+
+        # Replies are only loaded under the comments of the page
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                self.url, {"limit": 1, "cursor": response.data["next_cursor"]}
+            )
+        self.assertEqual(
+            [comment["content"] for comment in response.data["comments"]], ["2"]
+        )
+        self.assertIsNone(response.data["next_cursor"])
+
+        response = self.client.get(self.url, {"cursor": "nope"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_comment_thread_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Likes are part of the thread
+        self.client.put(reverse("like_comment", args=[self.first.id]))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_comment_thread_book_not_found(self):
+        response = self.client.get(reverse("comment_thread", args=[999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookPagesTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        self.content = "".join(f"Chapter {i}\n\n" + "word " * 1000 for i in range(5))
+        self.book = Book.objects.create(
+            title="Long Book",
+            content=self.content,
+            published_by=self.user
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_split_content(self):
+        pages = splitContent(self.content, size=1000)
+        self.assertEqual("".join(pages), self.content)
+        self.assertTrue(all(len(page) <= 1000 for page in pages))
+        self.assertEqual(splitContent(""), [])
+
+    def test_pages_follow_content(self):
+        self.book.refresh_from_db()
+        self.assertGreater(self.book.page_count, 1)
+        self.assertEqual(
+            "".join(page.getContent() for page in self.book.pages.all()), self.content
+        )
+        page = self.book.pages.first()
+        self.assertEqual(page.length, len(page.getContent()))
+
+        self.book.content = "Short"
+        self.book.save()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.page_count, 1)
+
+    def test_get_page(self):
+        response = self.client.get(reverse("book_page", args=[self.book.id, 2]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["pages"]), 1)
+        self.assertEqual(response.data["pages"][0]["page"], 2)
+
+    def test_range_request(self):
+        url = reverse("book_pages", args=[self.book.id])
+        response = self.client.get(url, HTTP_RANGE="pages=2-3")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(
+            response["Content-Range"], f"pages 2-3/{response.data['page_count']}"
+        )
+        self.assertEqual([page["page"] for page in response.data["pages"]], [2, 3])
+
+        response = self.client.get(url, HTTP_RANGE="pages=100-")
+        self.assertEqual(
+            response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+
+
+class CompressedContentTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = User.objects.create_user(
+            username="adminuser",
+            password="adminpassword",
+            is_staff=True
+        )
+        self.book = Book.objects.create(
+            title="Test Book",
+            content="Plain content " * 100,
+            published_by=self.admin_user
+        )
+        self.client.force_authenticate(user=self.admin_user)
+
+    def test_update_stores_compressed_content(self):
+        content = "New content " * 100
+        response = self.client.patch(
+            reverse("admin-books-edit", args=[self.book.id]),
+            {"content": content},
+            format="multipart",
+        )
+        self.assertEqual(response.data["content"], content)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.content, "")
+        self.assertEqual(decompressText(self.book.content_br), content)
+        self.assertEqual(self.book.getContent(), content)
+        self.assertLess(len(self.book.content_br), len(content))
+
+    def test_compress_book_content(self):
+        version = getVersion(f"book:{self.book.id}")
+        call_command("compress_book_content", stdout=StringIO())
+        self.assertNotEqual(getVersion(f"book:{self.book.id}"), version)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.content, "")
+        self.assertEqual(self.book.getContent(), "Plain content " * 100)
+
+    def test_content_served_compressed(self):
+        self.book.setContent(self.book.content)
+        self.book.save()
+        url = reverse("book_content", args=[self.book.id])
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(response.content, bytes(self.book.content_br))
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content.decode(), "Plain content " * 100)
+
+    def test_accepts_brotli(self):
+        factory = RequestFactory()
+        self.assertTrue(acceptsBrotli(factory.get("/", HTTP_ACCEPT_ENCODING="br")))
+        self.assertFalse(
+            acceptsBrotli(factory.get("/", HTTP_ACCEPT_ENCODING="gzip, br;q=0"))
+        )
+        self.assertFalse(acceptsBrotli(factory.get("/")))
+
+
+def makeImage(name="cover.png", size=(60, 90)):
+    # Build an uploaded PNG file for the cover tests
+    buffer = BytesIO()
+    Image.new("RGB", size, color=(200, 30, 30)).save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class FailingImageHost(ImageHost):
+    def upload(self, file, folder):
+        raise ConnectionError("Image host unreachable")
+
+
+class IncompleteImageHost(ImageHost):
+    def save(self, file, folder):
+        return ""
+
+
+@override_settings(BOOKS_IMAGE_HOST="books.imagehost.LocalImageHost")
+class CoverUploadJobTestCase(TestCase):
+    def setUp(self):
+        isolateReadBuffer(self)
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.client = APIClient()
+        self.admin_user = User.objects.create_user(
+            username="adminuser",
+            password="adminpassword",
+            is_staff=True
+        )
+        self.client.force_authenticate(user=self.admin_user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload(self):
+        return self.client.post(
+            reverse("upload-book"),
+            {"title": "Test Book", "content": "Test Content", "image_url": makeImage()},
+            format="multipart",
+        )
+
+    def test_upload_enqueues_cover(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["image_url"], "")
+        self.assertEqual(response.data["cover_job"]["status"], Job.Status.PENDING)
+
+        # The cover upload and the creation of its derivatives
+        self.assertEqual(runPendingJobs(), 2)
+
+        book = Book.objects.get(id=response.data["id"])
+        self.assertTrue(book.image_url_link.startswith("/media/image_host/"))
+        job = Job.objects.get(id=response.data["cover_job"]["id"])
+        self.assertEqual(job.status, Job.Status.DONE)
+
+        # The job status can be followed by the admin
+        response = self.client.get(reverse("job_status", args=[job.id]))
+        self.assertEqual(response.data["status"], Job.Status.DONE)
+        self.assertEqual(response.data["result"]["image_url"], book.image_url_link)
+
+    def test_upload_without_cover(self):
+        response = self.client.post(
+            reverse("upload-book"),
+            {"title": "Test Book", "content": "Test Content"},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.data["cover_job"])
+
+    def test_cover_derivatives(self):
+        response = self.upload()
+        runPendingJobs()
+
+        book = Book.objects.get(id=response.data["id"])
+        self.assertEqual(set(book.image_derivatives), set(DERIVATIVE_SIZES))
+        self.assertEqual(set(book.image_derivatives["thumbnail"]), {"webp", "jpeg"})
+
+        response = self.client.get(reverse("book_detail", args=[book.id]))
+        self.assertEqual(response.data["image_derivatives"], book.image_derivatives)
+
+    @override_settings(BOOKS_IMAGE_HOST="books.imagehost.CloudinaryImageHost")
+    def test_cloudinary_derivatives_have_distinct_public_ids(self):
+        self.upload()
+        with mock.patch("cloudinary.uploader.upload") as upload:
+            upload.side_effect = lambda file, **options: {
+                "secure_url": "https://images.example/{}/{}".format(
+                    options["folder"], options["public_id"]
+                )
+            }
+            self.assertEqual(runPendingJobs(), 2)
+
+        # The cover and one upload per size and format
+        public_ids = [call.kwargs["public_id"] for call in upload.call_args_list]
+        self.assertEqual(len(public_ids), 1 + 2 * len(DERIVATIVE_SIZES))
+        self.assertEqual(len(set(public_ids)), len(public_ids))
+        book = Book.objects.get()
+        thumbnail = book.image_derivatives["thumbnail"]
+        self.assertNotEqual(thumbnail["webp"], thumbnail["jpeg"])
+
+    def test_render_derivatives(self):
+        derivatives = renderDerivatives(makeImage(size=(1200, 1800)).read())
+        with Image.open(BytesIO(derivatives["thumbnail"]["webp"])) as image:
+            self.assertEqual(image.format, "WEBP")
+            self.assertEqual(image.size, DERIVATIVE_SIZES["thumbnail"])
+        # Small covers are not upscaled
+        derivatives = renderDerivatives(makeImage(size=(60, 90)).read())
+        with Image.open(BytesIO(derivatives["detail"]["jpeg"])) as image:
+            self.assertEqual(image.size, (60, 90))
+
+    def test_render_timeout_recycles_pool(self):
+        # A render that never finishes in time, the pool runs time.sleep(5)
+        with mock.patch.object(imaging, "IMAGE_TIMEOUT", 0.5), mock.patch.object(
+            imaging, "renderDerivatives", time.sleep
+        ):
+            with self.assertRaises(TimeoutError):
+                imaging.generateDerivatives(5)
+        self.assertIsNone(imaging._pool)
+        # The next render gets a new pool
+        derivatives = imaging.generateDerivatives(makeImage().read())
+        self.assertIn("thumbnail", derivatives)
+
+    @override_settings(BOOKS_IMAGE_HOST="books.tests.FailingImageHost")
+    def test_failed_upload_is_retried(self):
+        response = self.upload()
+        job = Job.objects.get(id=response.data["cover_job"]["id"])
+        job.max_attempts = 2
+        job.save()
+
+        runPendingJobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn("Image host unreachable", job.last_error)
+
+        # The retry is not due yet
+        self.assertEqual(runPendingJobs(), 0)
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        runPendingJobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+
+    @override_settings(BOOKS_IMAGE_HOST="books.tests.IncompleteImageHost")
+    def test_image_host_without_upload(self):
+        with self.assertRaises(TypeError):
+            getImageHost()
+
+    def test_lost_jobs(self):
+        stale = timezone.now() - timedelta(hours=1)
+        retried, exhausted = [
+            Job.objects.create(
+                kind="upload_cover",
+                status=Job.Status.RUNNING,
+                attempts=attempts,
+                max_attempts=3,
+            )
+            for attempts in (1, 3)
+        ]
+        Job.objects.update(date_updated=stale)
+        running = Job.objects.create(kind="upload_cover", status=Job.Status.RUNNING)
+
+        self.assertEqual(requeueLostJobs(), 1)
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(retried.status, Job.Status.PENDING)
+        self.assertEqual(exhausted.status, Job.Status.FAILED)
+        self.assertIn("Worker lost", exhausted.last_error)
+        self.assertEqual(running.status, Job.Status.RUNNING)
+
+    def test_identical_covers_are_stored_once(self):
+        first = Book.objects.get(id=self.upload().data["id"])
+        runPendingJobs()
+        second = Book.objects.get(id=self.upload().data["id"])
+
+        # Covers are named after their content hash, whatever the book title
+        digest = hashlib.sha256(makeImage().read()).hexdigest()
+        self.assertEqual(first.image_url.name, f"book_covers/{digest[:2]}/{digest}.png")
+        self.assertEqual(second.image_url.name, first.image_url.name)
+        self.assertEqual(
+            os.listdir(os.path.join(self.media_root, "book_covers", digest[:2])),
+            [f"{digest}.png"],
+        )
+
+        # The second book reuses the hosted cover and derivatives
+        with mock.patch.object(LocalImageHost, "upload") as upload:
+            self.assertEqual(runPendingJobs(), 2)
+        upload.assert_not_called()
+        second.refresh_from_db()
+        first.refresh_from_db()
+        self.assertEqual(second.image_url_link, first.image_url_link)
+        self.assertEqual(second.image_derivatives, first.image_derivatives)
+
+    def test_job_status_requires_admin(self):
+        job = Job.objects.create(kind="upload_cover", payload={})
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse("job_status", args=[job.id]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BookBatchViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        self.books = [
+            Book.objects.create(title=f"Book {i}", published_by=self.user)
+            for i in range(5)
+        ]
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("book_batch")
+
+    def test_batch(self):
+        ids = [self.books[3].id, 999, self.books[0].id, self.books[3].id]
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"ids": ",".join(map(str, ids))})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Requested order, without duplicates
+        self.assertEqual(
+            [book["title"] for book in response.data["results"]], ["Book 3", "Book 0"]
+        )
+        self.assertEqual(response.data["missing"], [999])
+        self.assertEqual(
+            response.data["results"][0]["published_by"]["username"], "testuser"
+        )
+        self.assertNotIn("content", response.data["results"][0])
+
+        response = self.client.get(
+            self.url, {"ids": str(self.books[0].id)}, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_batch_invalid(self):
+        for ids in ("", "1,a", ",".join(str(i) for i in range(1, 52))):
+            response = self.client.get(self.url, {"ids": ids})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BookAutocompleteViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword",
+            is_staff=True,
+        )
+        self.books = {
+            title: Book.objects.create(title=title, published_by=self.user)
+            for title in (
+                "Moby Dick",
+                "Les Misérables",
+                "The Old Man and the Sea",
+                "Mobile",
+                "The Great Gatsby",
+            )
+        }
+        titleIndex.load()
+        self.url = reverse("book_autocomplete")
+
+    def suggest(self, q, **params):
+        response = self.client.get(self.url, {"q": q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(book["title"], book["match"]) for book in response.data["results"]]
+
+    def test_prefix(self):
+        with self.assertNumQueries(0):
+            suggestions = self.suggest("mob")
+        # Shorter titles first
+        self.assertEqual(suggestions, [("Mobile", "prefix"), ("Moby Dick", "prefix")])
+        # Any word, without accents
+        self.assertEqual(self.suggest("MISER"), [("Les Misérables", "prefix")])
+        self.assertEqual(self.suggest("mob", limit=1), [("Mobile", "prefix")])
+        self.assertEqual(self.suggest(""), [])
+
+    def test_fuzzy(self):
+        self.assertEqual(self.suggest("moby dik"), [("Moby Dick", "fuzzy")])
+        self.assertEqual(self.suggest("olf man"), [("The Old Man and the Sea", "fuzzy")])
+        self.assertEqual(self.suggest("xyz"), [])
+
+    def test_fuzzy_transposed_letters(self):
+        self.assertEqual(self.suggest("gatbsy"), [("The Great Gatsby", "fuzzy")])
+        self.assertEqual(self.suggest("grate gatsb"), [("The Great Gatsby", "fuzzy")])
+        self.assertEqual(editDistance("gatbsy", "gatsby"), 1)
+
+    def test_index_follows_changes(self):
+        book = self.books["Mobile"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(user=self.user)
+            self.client.patch(
+                reverse("admin-books-edit", kwargs={"id": book.id}),
+                {"title": "Automobile"},
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest("mob"), [("Moby Dick", "prefix")])
+        self.assertEqual(self.suggest("auto"), [("Automobile", "prefix")])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books["Moby Dick"].delete()
+            Book.objects.create(title="Mobster", published_by=self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest("mob"), [("Mobster", "prefix")])
+
+    def test_reloads_after_other_process_changes(self):
+        Book.objects.create(title="Moby Dick 2", published_by=self.user)
+        self.assertNotIn(("Moby Dick 2", "prefix"), self.suggest("moby"))
+        # Another process bumped the version
+        bumpVersion("titles")
+        titleIndex._checked = 0
+        self.assertIn(("Moby Dick 2", "prefix"), self.suggest("moby"))
+
+
+class SearchQueryTestCase(SimpleTestCase):
+    def test_compile(self):
+        cases = {
+            "whale": ("(whale)", '"whale"'),
+            '"white whale" ishm*': (
+                "(white <-> whale) & (ishm:*)",
+                '"white whale" "ishm"*',
+            ),
+            # Punctuation splits a word into a phrase, the prefix is its last word
+            "foo-bar*": ("(foo <-> bar:*)", '"foo bar"*'),
+            "don't*": ("(don <-> t:*)", '"don t"*'),
+        }
+        for query, (postgres, sqlite) in cases.items():
+            terms = parseQuery(query)
+            self.assertEqual(PostgresSearch().compile(terms), postgres)
+            self.assertEqual(SQLiteSearch().compile(terms), sqlite)
+
+
+class BookSearchViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword",
+            is_staff=True,
+        )
+        self.whale = Book(title="Moby Dick", published_by=self.user)
+        self.whale.setContent("Call me Ishmael. The white whale swam <away>.")
+        self.whale.save()
+        self.sea = Book(title="The Old Man and the Sea", published_by=self.user)
+        self.sea.setContent("He fished alone in a skiff and saw a whale once.")
+        self.sea.save()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("book_search")
+
+    def search(self, q, **params):
+        response = self.client.get(self.url, {"q": q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_search_ranks_and_highlights(self):
+        response = self.search("whale")
+        results = response.data["results"]
+        self.assertEqual([book["id"] for book in results], [self.whale.id, self.sea.id])
+        self.assertIn("<mark>whale</mark>", results[0]["snippet"])
+        # The text of the book is escaped
+        self.assertIn("&lt;away&gt;", results[0]["snippet"])
+        self.assertNotIn("content", results[0])
+
+        # Every term must match
+        results = self.search("sea whale").data["results"]
+        self.assertEqual([book["id"] for book in results], [self.sea.id])
+        results = self.search("old").data["results"]
+        self.assertEqual(results[0]["title_highlight"], "The <mark>Old</mark> Man and the Sea")
+
+    def test_phrase_and_prefix(self):
+        results = self.search('"white whale"').data["results"]
+        self.assertEqual([book["id"] for book in results], [self.whale.id])
+        self.assertEqual(self.search('"whale white"').data["results"], [])
+        results = self.search("ishm*").data["results"]
+        self.assertEqual([book["id"] for book in results], [self.whale.id])
+
+    def test_pagination(self):
+        response = self.search("whale", limit=1)
+        self.assertEqual(len(response.data["results"]), 1)
+        response = self.search("whale", limit=1, cursor=response.data["next_cursor"])
+        self.assertEqual(response.data["results"][0]["id"], self.sea.id)
+        self.assertIsNone(response.data["next_cursor"])
+
+    def test_index_follows_updates(self):
+        self.client.patch(
+            reverse("admin-books-edit", kwargs={"id": self.sea.id}),
+            {"content": "A marlin, not a cetacean."},
+        )
+        results = self.search("whale").data["results"]
+        self.assertEqual([book["id"] for book in results], [self.whale.id])
+        self.assertEqual(len(self.search("marlin").data["results"]), 1)
+
+        self.client.delete(reverse("admin-books-delete", kwargs={"id": self.whale.id}))
+        self.assertEqual(self.search("whale").data["results"], [])
+
+    def test_snippet_from_matching_page(self):
+        book = Book(title="Long Book", published_by=self.user)
+        book.setContent("Filler words here. " * 400 + "The harpoon <struck> twice.")
+        book.save()
+        self.assertGreater(book.page_count, 1)
+
+        results = self.search("harpoon").data["results"]
+        self.assertEqual([result["id"] for result in results], [book.id])
+        self.assertIn("<mark>harpoon</mark> &lt;struck&gt;", results[0]["snippet"])
+
+        # Only the words are indexed, not the text of the books
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE name LIKE %s",
+                ["books_book%_search_content"],
+            )
+            self.assertEqual(cursor.fetchall(), [])
+
+    def test_rebuild_index(self):
+        self.sea.title = "The Old Man"
+        self.sea.save()
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(len(self.search("whale").data["results"]), 2)
+        self.assertEqual(self.search("sea").data["results"], [])
+        results = self.search("skiff").data["results"]
+        self.assertIn("<mark>skiff</mark>", results[0]["snippet"])
+
+    def test_invalid_query(self):
+        for q in ("", "  ", '"?!"', "a" * 201):
+            response = self.client.get(self.url, {"q": q})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {"q": "whale", "cursor": "nope"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecommendationsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [
+            User.objects.create_user(username=f"reader{i}", password="testpassword")
+            for i in range(3)
+        ]
+        self.a, self.b, self.c, self.d = [
+            Book.objects.create(title=title, published_by=self.users[0])
+            for title in "ABCD"
+        ]
+        reads = {0: [self.a, self.b, self.c], 1: [self.a, self.b], 2: [self.b, self.d]}
+        ReadBook.objects.bulk_create(
+            ReadBook(user=self.users[i], book=book, read_date=timezone.now())
+            for i, books in reads.items()
+            for book in books
+        )
+        self.client.force_authenticate(user=self.users[1])
+
+    def getTitles(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [book["title"] for book in response.data["results"]]
+
+    def test_similar_books(self):
+        call_command("refresh_similar_books", stdout=StringIO())
+        url = reverse("similar_books", kwargs={"id": self.a.id})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        # Cosine similarity: 2 / sqrt(2 * 3) for B, 1 / sqrt(2 * 1) for C
+        self.assertEqual(self.getTitles(response), ["B", "C"])
+        self.assertEqual(response.data["results"][0]["score"], 0.8165)
+        self.assertEqual(response.data["results"][0]["co_readers"], 2)
+        # Ties are ranked by book id
+        url = reverse("similar_books", kwargs={"id": self.b.id})
+        self.assertEqual(self.getTitles(self.client.get(url)), ["A", "C", "D"])
+
+        refreshSimilarities(k=1)
+        self.assertEqual(self.getTitles(self.client.get(url)), ["A"])
+        self.assertEqual(BookSimilarity.objects.count(), 4)
+
+    def test_similar_books_not_found(self):
+        response = self.client.get(reverse("similar_books", kwargs={"id": 999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse("similar_books", kwargs={"id": self.d.id}))
+        self.assertEqual(self.getTitles(response), [])
+
+    def test_recommendations(self):
+        refreshSimilarities()
+        url = reverse("book_recommendations")
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        # C is similar to both books read, D only to B, A and B are already read
+        self.assertEqual(self.getTitles(response), ["C", "D"])
+        self.assertEqual(self.getTitles(self.client.get(url, {"limit": 1})), ["C"])
+
+        self.client.force_authenticate(user=User.objects.create_user(username="new"))
+        self.assertEqual(self.getTitles(self.client.get(url)), [])
+
+
+class SyncViewTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="testuser",
+            password="testpassword"
+        )
+        self.books = [
+            Book.objects.create(title=f"Book {i}", published_by=self.user)
+            for i in range(3)
+        ]
+        self.comment = Comment.objects.create(
+            book=self.books[0], user=self.user, content="Comment"
+        )
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("sync")
+
+    def test_sync(self):
+        Rating.objects.create(user=self.user, book=self.books[1], rating=2)
+        Book.objects.filter(id=self.books[1].id).update(
+            rating_sum=2, rating_count=1, rating_2=1
+        )
+        data = {
+            "ratings": [
+                {"book": self.books[0].id, "rating": 4},
+                {"book": self.books[1].id, "rating": 5},
+                {"book": self.books[0].id, "rating": 3},
+                {"book": 999, "rating": 3},
+                {"book": self.books[2].id, "rating": 6},
+            ],
+            "comments": [
+                {"book": self.books[0].id, "content": "Offline comment"},
+                {"book": self.books[0].id, "content": "Reply", "parent": self.comment.id},
+                {"book": self.books[1].id, "content": "Reply", "parent": self.comment.id},
+                {"book": self.books[1].id, "content": ""},
+            ],
+            "reads": [
+                {"book": self.books[0].id, "read_date": "2023-10-01T12:00:00Z"},
+                {"book": self.books[0].id},
+                {"book": self.books[1].id, "read_date": "yesterday"},
+            ],
+        }
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        statuses = {
+            kind: [result["status"] for result in results]
+            for kind, results in response.data.items()
+        }
+        self.assertEqual(
+            statuses,
+            {
+                "ratings": ["created", "updated", "updated", "error", "error"],
+                "comments": ["created", "created", "error", "error"],
+                "reads": ["created", "already_read", "error"],
+            },
+        )
+
+        # The last rating of a book is kept and the aggregates follow
+        self.books[0].refresh_from_db()
+        self.assertEqual(Rating.objects.get(book=self.books[0]).rating, 3)
+        self.assertEqual((self.books[0].rating_sum, self.books[0].rating_count), (3, 1))
+        self.assertEqual(self.books[0].rating_3, 1)
+        self.assertEqual(self.books[0].rating_4, 0)
+        self.books[1].refresh_from_db()
+        self.assertEqual(self.books[1].rating_histogram["2"], 0)
+        self.assertEqual(self.books[1].average_rating, 5)
+
+        # Comment counters
+        self.assertEqual(self.books[0].comment_count, 1)
+        self.assertEqual(self.books[0].total_comment_count, 2)
+        self.assertEqual(Comment.objects.get(id=self.comment.id).reply_count, 1)
+
+        read = ReadBook.objects.get(user=self.user, book=self.books[0])
+        self.assertEqual(read.read_date.isoformat(), "2023-10-01T12:00:00+00:00")
+        self.assertEqual(self.books[0].reader_count, 1)
+
+    def test_sync_queries_do_not_grow_with_items(self):
+        data = {
+            "ratings": [{"book": book.id, "rating": 4} for book in self.books],
+            "comments": [
+                {"book": book.id, "content": "Comment"} for book in self.books
+            ] * 5,
+            "reads": [{"book": book.id} for book in self.books],
+        }
+        with self.assertNumQueries(18):
+            self.client.post(self.url, data, format="json")
+
+    def test_sync_invalid(self):
+        response = self.client.post(self.url, {"ratings": {}}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            self.url,
+            {"reads": [{"book": self.books[0].id}] * 501},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from .models import Comment
+
+# Deepest level of replies a comment thread can be requested with
+MAX_THREAD_DEPTH = getattr(settings, "COMMENT_THREAD_MAX_DEPTH", 10)
+
+
+def likedBy(user_id: int):
+    # Whether the user liked each comment of a queryset, as an EXISTS subquery
+    return Exists(
+        Comment.likes.through.objects.filter(comment=OuterRef("pk"), user_id=user_id)
+    )
+
+
+def getThreadComments(user_id: int):
+    # Comments with their user and whether user_id liked them, oldest first
+    return (
+        Comment.objects.select_related("user")
+        .only(
+            "content",
+            "date_posted",
+            "parent_comment_id",
+            "reply_count",
+            "like_count",
+            "user__username",
+            "user__email",
+            "user__is_staff",
+        )
+        .annotate(liked_by_me=likedBy(user_id))
+        .order_by("date_posted", "id")
+    )
+
+
+def buildCommentTree(comments: list, depth: int, user_id: int) -> list:
+    """
+    Nest the replies of a page of top-level comments under them, down to
+    `depth` levels.
+
+    Top-level comments are level 1. The replies are loaded one level at a
+    time and only under the comments of the page, so a thread costs one query
+    per level. Replies below `depth` are left out, but every comment keeps its
+    `reply_count` so clients know there are more.
+    """
+    children = {}
+    level = comments
+    for _ in range(depth - 1):
+        parent_ids = [comment.id for comment in level if comment.reply_count]
+        if not parent_ids:
+            break
+        level = list(getThreadComments(user_id).filter(parent_comment_id__in=parent_ids))
+        for comment in level:
+            children.setdefault(comment.parent_comment_id, []).append(comment)
+
+    def assemble(comment, level):
+        node = {
+            "id": comment.id,
+            "content": comment.content,
+            "date_posted": comment.date_posted,
+            "user": {
+                "username": comment.user.username,
+                "is_admin": comment.user.is_staff,
+                "email": comment.user.email,
+            },
+            "like_count": comment.like_count,
+            "liked_by_me": comment.liked_by_me,
+            "reply_count": comment.reply_count,
+        }
+        if level < depth:
+            node["replies"] = [
+                assemble(reply, level + 1) for reply in children.get(comment.id, [])
+            ]
+        return node
+
+    return [assemble(comment, 1) for comment in comments]
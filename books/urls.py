@@ -2,7 +2,16 @@ from django.urls import path
 from .views import (
     ListBooksView,
     bookView,
+    bookBatchView,
+    bookSearchView,
+    bookAutocompleteView,
+    recommendationsView,
+    similarBooksView,
+    bookPagesView,
+    bookContentView,
+    jobStatusView,
     listCommentsView,
+    commentThreadView,
     addCommentsView,
     listRepliesView,
     replyToCommentView,
@@ -11,12 +20,23 @@ from .views import (
     addRatingView,
     likeCommentView,
     getCommentLikesView,
+    syncView,
 )
 
 urlpatterns = [
     path("", ListBooksView.as_view(), name="book_list"),
+    path("batch/", bookBatchView, name="book_batch"),
+    path("search/", bookSearchView, name="book_search"),
+    path("autocomplete/", bookAutocompleteView, name="book_autocomplete"),
+    path("recommendations/", recommendationsView, name="book_recommendations"),
     path("<int:id>/", bookView, name="book_detail"),
+    path("<int:id>/similar/", similarBooksView, name="similar_books"),
+    path("<int:id>/content/", bookContentView, name="book_content"),
+    path("<int:id>/pages/", bookPagesView, name="book_pages"),
+    path("<int:id>/pages/<int:page>/", bookPagesView, name="book_page"),
+    path("jobs/<int:job_id>/", jobStatusView, name="job_status"),
     path("comment/list/<int:book_id>/", listCommentsView, name="list_comments"),
+    path("comment/thread/<int:book_id>/", commentThreadView, name="comment_thread"),
     path("comment/add/<int:book_id>/", addCommentsView, name="add_comment"),
     path("comment/reply/list/<int:comment_id>/", listRepliesView, name="list_replies"),
     path("comment/reply/<int:comment_id>/", replyToCommentView, name="reply_comment"),
@@ -25,4 +45,5 @@ urlpatterns = [
     path("comment/like/<int:comment_id>/", likeCommentView, name="like_comment"),
     path("comment/likes/<int:comment_id>/", getCommentLikesView, name="get_comment_likes"),
     path("rate/<int:id>/", addRatingView, name="add_rating"),
+    path("sync/", syncView, name="sync"),
 ]
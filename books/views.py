@@ -1,4 +1,4 @@
-from urllib.parse import unquote
+from urllib.parse import urlencode
 from rest_framework import status
 from rest_framework.decorators import (
     api_view,
@@ -8,72 +8,115 @@ from rest_framework.decorators import (
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-import cloudinary.uploader
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_protect
 from knox.auth import TokenAuthentication
-from datetime import datetime
-from .models import Book, Rating, Comment
+from .autocomplete import DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS, titleIndex
+from .cache import cachedData, getVersion, invalidateCommentLikes
+from .compression import acceptsBrotli
+from .conditional import isNotModified, makeETag, notModifiedResponse
+from .jobs import enqueueCoverUpload
+from .models import Book, BookPage, BookSimilarity, Job, Rating, Comment
+from .pages import InvalidPageRange, parsePageRange
+from .pagination import (
+    PaginationError,
+    decodeCursor,
+    encodeCursor,
+    getPageSize,
+    keysetPaginate,
+)
+from .readbuffer import readBuffer
+from .search import SearchError, searchBooks
+from .sync import SyncError, applyRatings, applySync
+from .threads import (
+    MAX_THREAD_DEPTH,
+    buildCommentTree,
+    getThreadComments,
+    likedBy,
+)
 
 
-def getAverageRating(book_id: int) -> float:
-    ratings = Rating.objects.filter(book_id=book_id)
-    average_rating: float = (
-        round(float(sum(rating.rating for rating in ratings) / len(ratings)), 1)
-        if ratings
-        else 0
-    )
-    return average_rating
+# Most books that can be fetched at once by bookBatchView
+MAX_BATCH_IDS = getattr(settings, "BOOKS_MAX_BATCH_IDS", 50)
 
 
-# localhost:8000/books/
-@permission_classes([AllowAny])
-class ListBooksView(APIView):
-    def get(self, request):
-        # Get list of books from context
-        book_list = Book.objects.all()
-
-        # Create a list of dictionaries containing book details from the book list
-        books = [
-            {
-                "id": book.id,
-                "title": book.title,
-                "image_url": book.image_url_link if book.image_url_link else "",
-                "content": book.content,
-                "date_published": book.date_published,
-                "published_by": {
-                    "username": book.published_by.username if book.published_by else "",
-                    "email": book.published_by.email if book.published_by else "",
-                },
-                "average_rating": getAverageRating(book.id),
-                "total_ratings": Rating.objects.filter(book_id=book.id).count(),
-                "total_comments": Comment.objects.filter(book_id=book.id).count(),
-            }
-            for book in book_list
-        ]
+def getBookSummary(book: Book) -> dict:
+    # Details of a book shown in lists, without its content
+    return {
+        "id": book.id,
+        "title": book.title,
+        "image_url": book.image_url_link if book.image_url_link else "",
+        "image_derivatives": book.image_derivatives,
+        "date_published": book.date_published,
+        "published_by": {
+            "username": book.published_by.username if book.published_by else "",
+            "email": book.published_by.email if book.published_by else "",
+        },
+        "average_rating": book.average_rating,
+        "total_ratings": book.rating_count,
+        "rating_histogram": book.rating_histogram,
+        "total_comments": book.total_comment_count,
+    }
 
-        # Return the list of books as JSON
-        return Response(books, status=status.HTTP_200_OK)
 
+def getCatalog(params) -> dict:
+    """
+    Build the catalog returned by ListBooksView for the given query parameters.
+
+    Raises PaginationError when the pagination parameters are invalid.
+    """
+    # Get list of books with their publisher in one query
+    book_list = Book.objects.select_related("published_by")
+
+    # Paginated listing mode, selected by passing a cursor or a page size
+    paginate = "cursor" in params or "limit" in params
+    include_content = not paginate or params.get("include_content") == "true"
+
+    next_cursor = None
+    if paginate:
+        if not include_content:
+            book_list = book_list.defer("content", "content_br")
+        book_list, next_cursor = keysetPaginate(
+            book_list,
+            ["date_published", "id"],
+            params.get("cursor"),
+            getPageSize(params),
+            descending=True,
+        )
 
-# localhost:8000/books/<int:id>/
-@api_view(["GET"])
-@authentication_classes([TokenAuthentication])
-@permission_classes([IsAuthenticated])
-def bookView(request, id: int):
-    # Get book
-    book = get_object_or_404(Book, id=id)
-    # Get number of comments under the book
-    num_comments = Comment.objects.filter(
-        parent_comment__isnull=True, book_id=id
-    ).count()
+    # Create a list of dictionaries containing book details from the book list
+    books = []
+    for book in book_list:
+        data = getBookSummary(book)
+        if include_content:
+            data["content"] = book.getContent()
+        books.append(data)
+
+    if paginate:
+        return {"results": books, "next_cursor": next_cursor}
+    return books
+
+
+def getBookDetails(id: int, include_content: bool = False) -> dict:
+    """
+    Build the book details returned by bookView, raises Http404 if not found.
+
+    The content is only loaded when asked for, the table of contents lists the
+    pages to fetch it from bookPagesView instead.
+    """
+    books = Book.objects.select_related("published_by")
+    if not include_content:
+        books = books.defer("content", "content_br")
+    book = get_object_or_404(books, id=id)
     # Get list of ratings
-    ratings = Rating.objects.filter(book_id=id)
-    # Get average rating
-    average_rating: float = (
-        round(float(sum(rating.rating for rating in ratings) / len(ratings)), 1)
-        if ratings
-        else 0
+    ratings = Rating.objects.filter(book_id=id).select_related("user")
+    # Get the table of contents without loading the pages
+    pages = (
+        BookPage.objects.filter(book_id=id).values("number", "heading", "length")
     )
 
     # Create a dictionary containing book details
@@ -81,7 +124,7 @@ def bookView(request, id: int):
         "id": book.id,
         "title": book.title,
         "image_url": book.image_url_link if book.image_url_link else "",
-        "content": book.content,
+        "image_derivatives": book.image_derivatives,
         "date_published": book.date_published,
         "published_by": {
             "username": book.published_by.username if book.published_by else "",
@@ -98,16 +141,355 @@ def bookView(request, id: int):
             }
             for rating in ratings
         ],
-        "total_comments": num_comments,
-        "average_rating": average_rating,
+        "total_comments": book.comment_count,
+        "average_rating": book.average_rating,
+        "total_ratings": book.rating_count,
+        "rating_histogram": book.rating_histogram,
+        "page_count": book.page_count,
+        "table_of_contents": [
+            {
+                "page": page["number"],
+                "heading": page["heading"],
+                "length": page["length"],
+            }
+            for page in pages
+        ],
     }
+    if include_content:
+        data["content"] = book.getContent()
+    return data
+
+
+# localhost:8000/books/
+@permission_classes([AllowAny])
+class ListBooksView(APIView):
+    def get(self, request):
+        params = request.query_params
+        query = urlencode(sorted(params.items()))
+        # Answer polls of an unchanged catalog without building it
+        etag = makeETag("catalog", query)
+        if isNotModified(request, etag, exists=True):
+            return notModifiedResponse(etag)
+
+        # Cache the catalog per set of query parameters until any book changes
+        key = "books:catalog:{}:{}".format(getVersion("catalog"), query)
+        try:
+            books = cachedData(key, lambda: getCatalog(params))
+        except PaginationError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Return the list of books as JSON
+        return Response(books, status=status.HTTP_200_OK, headers={"ETag": etag})
+
+
+# localhost:8000/books/batch/?ids=<id>,<id> (name='book_batch')
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def bookBatchView(request):
+    try:
+        ids = [int(id) for id in request.query_params.get("ids", "").split(",") if id]
+    except ValueError:
+        return Response(
+            {"message": "ids must be a comma separated list of book ids"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    # Keep the first position of each id
+    ids = list(dict.fromkeys(ids))
+    if not ids or len(ids) > MAX_BATCH_IDS:
+        return Response(
+            {"message": f"Between 1 and {MAX_BATCH_IDS} book ids must be requested"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    # Every book changes the catalog version, so it also versions any batch
+    etag = makeETag("catalog", *ids)
+    if isNotModified(request, etag, exists=True):
+        return notModifiedResponse(etag)
+
+    # Get the books with their publishers in one query, aggregates are counters
+    books = (
+        Book.objects.select_related("published_by")
+        .defer("content", "content_br")
+        .in_bulk(ids)
+    )
+    return Response(
+        {
+            "results": [getBookSummary(books[id]) for id in ids if id in books],
+            "missing": [id for id in ids if id not in books],
+        },
+        status=status.HTTP_200_OK,
+        headers={"ETag": etag},
+    )
+
+
+# localhost:8000/books/autocomplete/?q=<prefix> (name='book_autocomplete')
+@api_view(["GET"])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def bookAutocompleteView(request):
+    # Titles are public like the catalog, so no token is looked up per keystroke
+    try:
+        limit = int(request.query_params.get("limit", DEFAULT_SUGGESTIONS))
+    except ValueError:
+        return Response(
+            {"message": "Limit must be a number"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    limit = max(1, min(limit, MAX_SUGGESTIONS))
+
+    # Answered from the in-memory title index, without querying the database
+    suggestions = titleIndex.suggest(request.query_params.get("q", ""), limit)
+    return Response(
+        {
+            "results": [
+                {"id": book_id, "title": title, "match": match}
+                for book_id, title, match in suggestions
+            ]
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+# localhost:8000/books/search/?q=<query> (name='book_search')
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def bookSearchView(request):
+    params = request.query_params
+    # Results are ranked, so the cursor of a page is the offset of the next one
+    try:
+        limit = getPageSize(params)
+        cursor = params.get("cursor")
+        offset = int(decodeCursor(cursor)[0]) if cursor else 0
+    except (PaginationError, ValueError, IndexError):
+        return Response(
+            {"message": "Invalid limit or cursor"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    # Every book change bumps the catalog version, which also versions the index
+    etag = makeETag("catalog", "search", urlencode(sorted(params.items())))
+    if isNotModified(request, etag, exists=True):
+        return notModifiedResponse(etag)
+
+    # Rank the matches in the index, then load the page of books in one query
+    try:
+        matches = searchBooks(params.get("q"), limit + 1, offset)
+    except SearchError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    next_cursor = None
+    if len(matches) > limit:
+        matches = matches[:limit]
+        next_cursor = encodeCursor([offset + limit])
+    books = (
+        Book.objects.select_related("published_by")
+        .defer("content", "content_br")
+        .in_bulk([match["id"] for match in matches])
+    )
+
+    results = [
+        {
+            **getBookSummary(books[match["id"]]),
+            "title_highlight": match["title_highlight"],
+            "snippet": match["snippet"],
+            "score": match["score"],
+        }
+        for match in matches
+        if match["id"] in books
+    ]
+    return Response(
+        {"results": results, "next_cursor": next_cursor},
+        status=status.HTTP_200_OK,
+        headers={"ETag": etag},
+    )
+
 
-    # Mark book as read by user
-    if not book.read_by.filter(id=request.user.id).exists():
-        book.read_by.add(request.user, through_defaults={"read_date": datetime.now()})
-        book.save()
+# localhost:8000/books/<int:id>/
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def bookView(request, id: int):
+    include_content = request.query_params.get("include_content") == "true"
+    etag = makeETag(f"book:{id}", include_content)
+    if isNotModified(request, etag):
+        # The client already has the book, it still counts as a read
+        readBuffer.record(request.user.id, id)
+        return notModifiedResponse(etag)
+
+    # Get book details, cached until the book, its ratings or comments change
+    key = "books:detail:{}:{}:{}".format(
+        id, getVersion(f"book:{id}"), include_content
+    )
+    data = cachedData(key, lambda: getBookDetails(id, include_content))
+
+    # Mark book as read by user, the read is written by the next buffer flush
+    readBuffer.record(request.user.id, id)
+    # "*" is only answered now that the book is known to exist
+    if isNotModified(request, etag, exists=True):
+        return notModifiedResponse(etag)
     # Return the book as JSON
-    return Response(data, status=status.HTTP_200_OK)
+    return Response(data, status=status.HTTP_200_OK, headers={"ETag": etag})
+
+
+# localhost:8000/books/<int:id>/similar/ (name='similar_books')
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def similarBooksView(request, id: int):
+    try:
+        limit = getPageSize(request.query_params, default=10)
+    except PaginationError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Precomputed by refresh_similar_books, read with the books in one query
+    similarities = list(
+        BookSimilarity.objects.filter(book_id=id)
+        .select_related("similar__published_by")
+        .defer("similar__content", "similar__content_br")
+        .order_by("rank")[:limit]
+    )
+    if not similarities and not Book.objects.filter(id=id).exists():
+        return Response(
+            {"message": "Book not found"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    results = [
+        {
+            **getBookSummary(similarity.similar),
+            "score": round(similarity.score, 4),
+            "co_readers": similarity.co_readers,
+        }
+        for similarity in similarities
+    ]
+    return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+# localhost:8000/books/recommendations/ (name='book_recommendations')
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def recommendationsView(request):
+    try:
+        limit = getPageSize(request.query_params, default=10)
+    except PaginationError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Books similar to the books the user read, scored by the sum of their
+    # similarities, without the books the user already read
+    books = (
+        Book.objects.filter(similar_to__book__read_by=request.user)
+        .exclude(read_by=request.user)
+        .annotate(score=Sum("similar_to__score"))
+        .select_related("published_by")
+        .defer("content", "content_br")
+        .order_by("-score", "id")[:limit]
+    )
+    results = [
+        {**getBookSummary(book), "score": round(book.score, 4)} for book in books
+    ]
+    return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+# localhost:8000/books/<int:id>/pages/ (name='book_pages')
+# localhost:8000/books/<int:id>/pages/<int:page>/ (name='book_page')
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def bookPagesView(request, id: int, page: int = None):
+    # The pages to return come from the URL, the Range header or ?pages=
+    range_header = request.META.get("HTTP_RANGE", "")
+    if page is not None:
+        spec = str(page)
+    elif range_header.startswith("pages="):
+        spec = range_header.removeprefix("pages=")
+    else:
+        spec = request.query_params.get("pages", "1-")
+    partial = page is None and range_header.startswith("pages=")
+
+    etag = makeETag(f"book:{id}", "pages", spec)
+    if isNotModified(request, etag):
+        return notModifiedResponse(etag)
+
+    # Check if book exists
+    try:
+        book = Book.objects.only("id", "page_count").get(id=id)
+    except Book.DoesNotExist:
+        return Response(
+            {"message": "Book not found"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    # "*" is only answered now that the book is known to exist
+    if isNotModified(request, etag, exists=True):
+        return notModifiedResponse(etag)
+
+    try:
+        first, last = parsePageRange(spec, book.page_count)
+    except InvalidPageRange as e:
+        return Response(
+            {"message": str(e)},
+            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"pages */{book.page_count}"},
+        )
+
+    # Only the requested pages are loaded
+    pages = BookPage.objects.filter(book_id=id, number__range=(first, last))
+    data = {
+        "id": id,
+        "page_count": book.page_count,
+        "pages": [
+            {
+                "page": page.number,
+                "heading": page.heading,
+                "content": page.getContent(),
+            }
+            for page in pages
+        ],
+    }
+
+    headers = {"ETag": etag, "Accept-Ranges": "pages"}
+    if partial:
+        headers["Content-Range"] = f"pages {first}-{last}/{book.page_count}"
+        return Response(data, status=status.HTTP_206_PARTIAL_CONTENT, headers=headers)
+    return Response(data, status=status.HTTP_200_OK, headers=headers)
+
+
+# localhost:8000/books/<int:id>/content/ (name='book_content')
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def bookContentView(request, id: int):
+    # Clients accepting br get the stored compressed bytes as they are
+    brotli = acceptsBrotli(request)
+    etag = makeETag(f"book:{id}", "content", brotli)
+    if isNotModified(request, etag):
+        return notModifiedResponse(etag)
+
+    # Check if book exists
+    try:
+        book = Book.objects.only("id", "content", "content_br").get(id=id)
+    except Book.DoesNotExist:
+        return Response(
+            {"message": "Book not found"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    # "*" is only answered now that the book is known to exist
+    if isNotModified(request, etag, exists=True):
+        return notModifiedResponse(etag)
+
+    if brotli and not book.content and book.content_br is not None:
+        response = HttpResponse(
+            bytes(book.content_br), content_type="text/plain; charset=utf-8"
+        )
+        response["Content-Encoding"] = "br"
+    else:
+        response = HttpResponse(
+            book.getContent(), content_type="text/plain; charset=utf-8"
+        )
+    response["ETag"] = etag
+    response["Vary"] = "Accept-Encoding"
+    return response
 
 
 # localhost:8000/books/upload/ (name='upload_book')
@@ -135,19 +517,13 @@ def uploadBookView(request):
     image_url = http_request.FILES.get("image_url")
     published_by = http_request.user
 
-    # Create book
+    # Create book, the cover is uploaded to the image host by a background job
     try:
-        book = Book.objects.create(
-            title=title, content=content, image_url=image_url, published_by=published_by
-        )
-        upload_result = cloudinary.uploader.upload(
-            f"{unquote(book.image_url.url.lstrip('/'))}",
-            folder=f"book_covers/{book.title}",
-            use_filename=True,
-            unique_filename=True,
-        )
-        book.image_url_link = upload_result["secure_url"]
-        book.save()
+        with transaction.atomic():
+            book = Book(title=title, image_url=image_url, published_by=published_by)
+            book.setContent(content)
+            book.save()
+            job = enqueueCoverUpload(book) if image_url else None
     except Exception as e:
         return Response(
             {"message": f"An error occurred while uploading the book\nError: {e}"},
@@ -159,12 +535,13 @@ def uploadBookView(request):
         "id": book.id,
         "title": book.title,
         "image_url": book.image_url_link if book.image_url_link else "",
-        "content": book.content,
+        "content": content,
         "date_published": book.date_published,
         "published_by": {
             "username": book.published_by.username if book.published_by else "",
             "email": book.published_by.email if book.published_by else "",
         },
+        "cover_job": {"id": job.id, "status": job.status} if job else None,
     }
     return Response(data, status=status.HTTP_201_CREATED)
 
@@ -199,45 +576,72 @@ def updateBookView(request, id: int):
             return Response({"message": "Nothing changed"}, status=status.HTTP_200_OK)
 
         # Update book
+        update_fields = ["date_published"]
         if title:
             book.title = title
+            update_fields.append("title")
         if content:
-            book.content = content
+            book.setContent(content)
+            update_fields += ["content", "content_br"]
         if image_url:
+            # The current cover stays until the new one is uploaded
             book.image_url = image_url
-            try:
-                book.image_url_link = cloudinary.uploader.upload(
-                    f"{unquote(book.image_url.url.lstrip('/'))}",
-                    folder=f"book_covers/{book.title}",
-                    use_filename=True,
-                    unique_filename=True,
-                )["secure_url"]
-            except Exception as e:
-                return Response(
-                    {
-                        "message": f"An error occurred while uploading the book\nError: {e}"
-                    },
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                )
-
-        # Save update
-        book.save()
+            update_fields.append("image_url")
+
+        # Save update, leaving the counters to the views that maintain them
+        with transaction.atomic():
+            book.save(update_fields=update_fields)
+            job = enqueueCoverUpload(book) if image_url else None
 
         # Return the book as JSON
         data = {
             "id": book.id,
             "title": book.title,
             "image_url": book.image_url_link if book.image_url_link else "",
-            "content": book.content,
+            "content": book.getContent(),
             "date_published": book.date_published,
             "published_by": {
                 "username": book.published_by.username if book.published_by else "",
                 "email": book.published_by.email if book.published_by else "",
             },
+            "cover_job": {"id": job.id, "status": job.status} if job else None,
         }
         return Response(data, status=status.HTTP_200_OK)
 
 
+# localhost:8000/books/jobs/<int:job_id>/ (name='job_status')
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def jobStatusView(request, job_id: int):
+    if not request.user.is_staff:
+        return Response(
+            {"message": "You are not authorized to perform this action"},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+
+    # Check if job exists
+    try:
+        job = Job.objects.get(id=job_id)
+    except Job.DoesNotExist:
+        return Response(
+            {"message": "Job not found"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    data = {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "run_after": job.run_after,
+        "result": job.result,
+        "last_error": job.last_error,
+    }
+    return Response(data, status=status.HTTP_200_OK)
+
+
 # localhost:8000/books/<int:id>/update/ (name='update_book')
 @api_view(["DELETE"])
 @authentication_classes([TokenAuthentication])
@@ -263,21 +667,48 @@ def deleteBookView(request, id: int):
     return Response({"message": "Book deleted successfully"}, status=status.HTTP_200_OK)
 
 
+def paginateComments(comments, params) -> tuple:
+    # Every comment, or one page when a cursor or a page size is passed
+    if "cursor" not in params and "limit" not in params:
+        return list(comments.order_by("date_posted", "id")), None
+    return keysetPaginate(
+        comments, ["date_posted", "id"], params.get("cursor"), getPageSize(params)
+    )
+
+
 # localhost:8000/books/comment/list/<int:book_id>/ (name='list_comments')
 @api_view(["GET"])
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def listCommentsView(request, book_id: int):
+    params = request.query_params
+    # Each user gets their own representation because of liked_by_me
+    query = urlencode(sorted(params.items()))
+    etag = makeETag(f"comments:{book_id}", query, request.user.id)
+    if isNotModified(request, etag):
+        return notModifiedResponse(etag)
+
     # Check if book exists
     try:
-        book = Book.objects.get(id=book_id)
+        book = Book.objects.only("comment_count").get(id=book_id)
     except Book.DoesNotExist:
         return Response(
             {"message": "Book not found"},
             status=status.HTTP_404_NOT_FOUND,
         )
-    # Get list of comments under the book
-    comments = Comment.objects.filter(parent_comment__isnull=True, book_id=book_id)
+    # "*" is only answered now that the book is known to exist
+    if isNotModified(request, etag, exists=True):
+        return notModifiedResponse(etag)
+    # Get the comments under the book, oldest first
+    comments = (
+        Comment.objects.filter(parent_comment__isnull=True, book_id=book_id)
+        .select_related("user")
+        .annotate(liked_by_me=likedBy(request.user.id))
+    )
+    try:
+        comments, next_cursor = paginateComments(comments, params)
+    except PaginationError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     # Create a list of dictionaries containing comment details from the comments list
     data = [
@@ -290,13 +721,81 @@ def listCommentsView(request, book_id: int):
                 "is_admin": comment.user.is_staff,
                 "email": comment.user.email,
             },
+            "reply_count": comment.reply_count,
+            "like_count": comment.like_count,
+            "liked_by_me": comment.liked_by_me,
         }
         for comment in comments
     ]
 
     # Return the list of comments as JSON
     return Response(
-        {"comments": data, "comment_count": len(comments)}, status=status.HTTP_200_OK
+        {
+            "comments": data,
+            "comment_count": book.comment_count,
+            "next_cursor": next_cursor,
+        },
+        status=status.HTTP_200_OK,
+        headers={"ETag": etag},
+    )
+
+
+# localhost:8000/books/comment/thread/<int:book_id>/?depth=<depth>&limit=<limit>&cursor=<cursor> (name='comment_thread')
+@api_view(["GET"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def commentThreadView(request, book_id: int):
+    params = request.query_params
+    try:
+        depth = int(params.get("depth", MAX_THREAD_DEPTH))
+    except ValueError:
+        depth = 0
+    if not 1 <= depth <= MAX_THREAD_DEPTH:
+        return Response(
+            {"message": f"depth must be between 1 and {MAX_THREAD_DEPTH}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    # Each user gets their own representation because of liked_by_me
+    query = urlencode(sorted(params.items()))
+    etag = makeETag(f"thread:{book_id}", depth, query, request.user.id)
+    if isNotModified(request, etag):
+        return notModifiedResponse(etag)
+
+    # Check if book exists
+    try:
+        book = Book.objects.only("total_comment_count").get(id=book_id)
+    except Book.DoesNotExist:
+        return Response(
+            {"message": "Book not found"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    # "*" is only answered now that the book is known to exist
+    if isNotModified(request, etag, exists=True):
+        return notModifiedResponse(etag)
+
+    # One page of top-level comments, their replies are loaded for that page only
+    try:
+        comments, next_cursor = keysetPaginate(
+            getThreadComments(request.user.id).filter(
+                book_id=book_id, parent_comment__isnull=True
+            ),
+            ["date_posted", "id"],
+            params.get("cursor"),
+            getPageSize(params),
+        )
+    except PaginationError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Return the nested comments as JSON
+    return Response(
+        {
+            "comments": buildCommentTree(comments, depth, request.user.id),
+            "comment_count": book.total_comment_count,
+            "next_cursor": next_cursor,
+        },
+        status=status.HTTP_200_OK,
+        headers={"ETag": etag},
     )
 
 
@@ -320,7 +819,12 @@ def addCommentsView(request, book_id: int):
     user = http_request.user
 
     # Create comment
-    comment = Comment.objects.create(content=content, book=book, user=user)
+    with transaction.atomic():
+        comment = Comment.objects.create(content=content, book=book, user=user)
+        Book.objects.filter(id=book_id).update(
+            comment_count=F("comment_count") + 1,
+            total_comment_count=F("total_comment_count") + 1,
+        )
 
     # Return the comment as JSON
     data = {
@@ -340,17 +844,35 @@ def addCommentsView(request, book_id: int):
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def listRepliesView(request, comment_id: int):
+    params = request.query_params
+    # Each user gets their own representation because of liked_by_me
+    query = urlencode(sorted(params.items()))
+    etag = makeETag(f"replies:{comment_id}", query, request.user.id)
+    if isNotModified(request, etag):
+        return notModifiedResponse(etag)
+
     # Check if comment exists
     try:
-        comment = Comment.objects.get(id=comment_id)
+        comment = Comment.objects.only("reply_count").get(id=comment_id)
     except Comment.DoesNotExist:
         return Response(
             {"message": "Comment not found"},
             status=status.HTTP_404_NOT_FOUND,
         )
-
-    # Get list of replies under the comment
-    replies = Comment.objects.filter(parent_comment_id=comment_id)
+    # "*" is only answered now that the comment is known to exist
+    if isNotModified(request, etag, exists=True):
+        return notModifiedResponse(etag)
+
+    # Get the replies under the comment, oldest first
+    replies = (
+        Comment.objects.filter(parent_comment_id=comment_id)
+        .select_related("user")
+        .annotate(liked_by_me=likedBy(request.user.id))
+    )
+    try:
+        replies, next_cursor = paginateComments(replies, params)
+    except PaginationError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     # Create a list of dictionaries containing reply details from the replies list
     data = [
@@ -363,13 +885,22 @@ def listRepliesView(request, comment_id: int):
                 "is_admin": reply.user.is_staff,
                 "email": reply.user.email,
             },
+            "reply_count": reply.reply_count,
+            "like_count": reply.like_count,
+            "liked_by_me": reply.liked_by_me,
         }
         for reply in replies
     ]
 
     # Return the replies as JSON
     return Response(
-        {"replies": data, "reply_count": len(replies)}, status=status.HTTP_200_OK
+        {
+            "replies": data,
+            "reply_count": comment.reply_count,
+            "next_cursor": next_cursor,
+        },
+        status=status.HTTP_200_OK,
+        headers={"ETag": etag},
     )
 
 
@@ -389,12 +920,17 @@ def replyToCommentView(request, comment_id):
     content = request.data.get("content")
     user = request.user
 
-    comment = Comment.objects.create(
-        content=content,
-        book=parent_comment.book,
-        user=user,
-        parent_comment=parent_comment,
-    )
+    with transaction.atomic():
+        comment = Comment.objects.create(
+            content=content,
+            book_id=parent_comment.book_id,
+            user=user,
+            parent_comment=parent_comment,
+        )
+        Book.objects.filter(id=parent_comment.book_id).update(
+            total_comment_count=F("total_comment_count") + 1
+        )
+        Comment.objects.filter(id=comment_id).update(reply_count=F("reply_count") + 1)
 
     data = {
         "id": comment.id,
@@ -437,7 +973,7 @@ def editCommentView(request, comment_id):
         )
 
     comment.content = content
-    comment.save()
+    comment.save(update_fields=["content"])
 
     data = {
         "id": comment.id,
@@ -472,37 +1008,90 @@ def deleteCommentView(request, comment_id):
             status=status.HTTP_403_FORBIDDEN,
         )
 
-    comment.delete()
+    with transaction.atomic():
+        # Deleting a comment also deletes its replies
+        _, deleted = comment.delete()
+        num_deleted = deleted.get(Comment._meta.label, 0)
+        Book.objects.filter(id=comment.book_id).update(
+            comment_count=F("comment_count")
+            - (1 if comment.parent_comment_id is None else 0),
+            total_comment_count=F("total_comment_count") - num_deleted,
+        )
+        if comment.parent_comment_id is not None:
+            Comment.objects.filter(id=comment.parent_comment_id).update(
+                reply_count=F("reply_count") - 1
+            )
     return Response(
         {"message": "Comment deleted successfully"}, status=status.HTTP_200_OK
     )
 
 
+def setCommentLike(comment: Comment, user_id: int, like: bool) -> bool:
+    """
+    Like or unlike a comment for a user, returns whether anything changed.
+
+    The like row is created or deleted first and the counter is only updated
+    when that changed a row, so repeated and concurrent requests neither fail
+    nor count a like twice.
+    """
+    Like = Comment.likes.through
+    with transaction.atomic():
+        if like:
+            _, changed = Like.objects.get_or_create(
+                comment_id=comment.id, user_id=user_id
+            )
+            delta = 1
+        else:
+            deleted, _ = Like.objects.filter(
+                comment_id=comment.id, user_id=user_id
+            ).delete()
+            changed = deleted > 0
+            delta = -1
+        if changed:
+            Comment.objects.filter(id=comment.id).update(
+                like_count=F("like_count") + delta
+            )
+    if changed:
+        invalidateCommentLikes(comment.id, comment.book_id, comment.parent_comment_id)
+    return changed
+
+
 # localhost:8000/books/comment/like/<int:comment_id>/ (name='like_comment')
-@api_view(["POST"])
+@api_view(["POST", "PUT", "DELETE"])
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def likeCommentView(request, comment_id):
     # Check if comment exists
     try:
-        comment = Comment.objects.get(id=comment_id)
+        comment = Comment.objects.only("book_id", "parent_comment_id").get(
+            id=comment_id
+        )
     except Comment.DoesNotExist:
         return Response(
             {"message": "Comment not found"},
             status=status.HTTP_404_NOT_FOUND,
         )
 
-    # Check if user has already liked the comment
-    if comment.likes.filter(id=request.user.id).exists():
-        # Unlike comment
-        comment.likes.remove(request.user)
-        comment.save()
-        return Response({"message": "Comment unliked"}, status=status.HTTP_200_OK)
+    # PUT likes and DELETE unlikes the comment, POST toggles the like
+    if request.method == "POST":
+        like = not Comment.likes.through.objects.filter(
+            comment_id=comment_id, user_id=request.user.id
+        ).exists()
+    else:
+        like = request.method == "PUT"
+    setCommentLike(comment, request.user.id, like)
 
-    # Like comment
-    comment.likes.add(request.user)
-    comment.save()
-    return Response({"message": "Comment liked"}, status=status.HTTP_200_OK)
+    like_count = Comment.objects.values_list("like_count", flat=True).get(
+        id=comment_id
+    )
+    return Response(
+        {
+            "message": "Comment liked" if like else "Comment unliked",
+            "liked": like,
+            "like_count": like_count,
+        },
+        status=status.HTTP_200_OK,
+    )
 
 
 # localhost:8000/books/comment/likes/<int:comment_id>/ (name='get_comment_likes')
@@ -510,31 +1099,57 @@ def likeCommentView(request, comment_id):
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def getCommentLikesView(request, comment_id):
+    params = request.query_params
+    etag = makeETag(f"likes:{comment_id}", urlencode(sorted(params.items())))
+    if isNotModified(request, etag):
+        return notModifiedResponse(etag)
+
     # Check if comment exists
     try:
-        comment = Comment.objects.get(id=comment_id)
+        comment = Comment.objects.only("like_count").get(id=comment_id)
     except Comment.DoesNotExist:
         return Response(
             {"message": "Comment not found"},
             status=status.HTTP_404_NOT_FOUND,
         )
+    # "*" is only answered now that the comment is known to exist
+    if isNotModified(request, etag, exists=True):
+        return notModifiedResponse(etag)
 
-    # Get list of users who liked the comment
-    likes = comment.likes.all()
+    # Only the number of likes, from the counter
+    if params.get("count_only") == "true":
+        return Response(
+            {"like_count": comment.like_count},
+            status=status.HTTP_200_OK,
+            headers={"ETag": etag},
+        )
+
+    # Get one page of the users who liked the comment, most recent first
+    likes = Comment.likes.through.objects.filter(comment_id=comment_id).select_related(
+        "user"
+    )
+    try:
+        likes, next_cursor = keysetPaginate(
+            likes, ["id"], params.get("cursor"), getPageSize(params), descending=True
+        )
+    except PaginationError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     # Create a list of dictionaries containing user details from the likes list
     data = [
         {
-            "id": like.id,
-            "username": like.username,
-            "email": like.email,
+            "id": like.user.id,
+            "username": like.user.username,
+            "email": like.user.email,
         }
         for like in likes
     ]
 
     # Return the list of users as JSON
     return Response(
-        {"likes": data, "like_count": len(likes)}, status=status.HTTP_200_OK
+        {"likes": data, "like_count": comment.like_count, "next_cursor": next_cursor},
+        status=status.HTTP_200_OK,
+        headers={"ETag": etag},
     )
 
 
@@ -543,56 +1158,55 @@ def getCommentLikesView(request, comment_id):
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 def addRatingView(request, id: int):
-    # Check if book exists
-    try:
-        book = Book.objects.get(id=id)
-    except Book.DoesNotExist:
-        return Response(
-            {"message": "Book not found"},
-            status=status.HTTP_404_NOT_FOUND,
-        )
-
-    # Access HttpRequest object
-    http_request = request._request
     # Get rating details from request
-    rating_str = request.data.get("rating")
-    rating = int(rating_str)
+    try:
+        rating = int(request.data.get("rating"))
+    except (TypeError, ValueError):
+        rating = 0
     # Check if rating is valid
     if rating < 1 or rating > 5:
         return Response(
             {"message": "Rating must be between 1 and 5"},
             status=status.HTTP_400_BAD_REQUEST,
         )
-    user = http_request.user
-
-    # Check if user has already rated the book
-    if Rating.objects.filter(book=book, user=user).exists():
-        # Update previous rating with new rating
-        ratingObj = Rating.objects.get(book=book, user=user)
-        ratingObj.rating = rating
-        ratingObj.save()
-
-        # Return the rating as JSON
-        data = {
-            "id": ratingObj.id,
-            "rating": ratingObj.rating,
-            "user": {
-                "username": ratingObj.user.username,
-                "email": ratingObj.user.email,
-            },
-        }
-        return Response(data, status=status.HTTP_200_OK)
+    user = request.user
 
-    # Create rating
-    rating = Rating.objects.create(rating=rating, book=book, user=user)
+    # Insert or update the rating and adjust the aggregates of the book
+    applied = applyRatings(user, {id: rating})
+    if id not in applied:
+        return Response(
+            {"message": "Book not found"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    rating_id, created = applied[id]
 
     # Return the rating as JSON
     data = {
-        "id": rating.id,
-        "rating": rating.rating,
+        "id": rating_id,
+        "rating": rating,
         "user": {
-            "username": rating.user.username,
-            "email": rating.user.email,
+            "username": user.username,
+            "email": user.email,
         },
     }
-    return Response(data, status=status.HTTP_201_CREATED)
+    if created:
+        return Response(data, status=status.HTTP_201_CREATED)
+    return Response(data, status=status.HTTP_200_OK)
+
+
+# localhost:8000/books/sync/ (name='sync')
+@api_view(["POST"])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def syncView(request):
+    # Apply the ratings, comments and reads made by a client while offline
+    if not isinstance(request.data, dict):
+        return Response(
+            {"message": "Expected a JSON object"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        results = applySync(request.user, request.data)
+    except SyncError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(results, status=status.HTTP_200_OK)
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web_project.settings')
 
 application = get_asgi_application()
+
+# Load the book titles before the first autocomplete request
+from books.autocomplete import titleIndex  # noqa: E402
+
+titleIndex.warm()
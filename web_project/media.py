@@ -0,0 +1,160 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+# Files whose name contains their SHA-256 never change and can be cached forever
+CONTENT_ADDRESSED_RE = re.compile(r"(?:^|/)([0-9a-f]{64})(?:\.[\w]+)?$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+# The MEDIA_MAX_AGE, MEDIA_SENDFILE and MEDIA_ACCEL_REDIRECT_PREFIX settings are
+# read on each request, see settings.py
+
+
+def getETag(path: str, stat) -> str:
+    match = CONTENT_ADDRESSED_RE.search(path)
+    if match:
+        return f'"{match.group(1)}"'
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def getCacheControl(path: str) -> str:
+    if CONTENT_ADDRESSED_RE.search(path):
+        return "public, max-age=31536000, immutable"
+    # Cache lifetime of media files that are not content addressed
+    return f"public, max-age={getattr(settings, 'MEDIA_MAX_AGE', 60 * 60)}"
+
+
+def parseRange(header: str, size: int):
+    """
+    Parse a single byte range header into (start, end), both inclusive.
+
+    Returns None when the header is missing, not a single byte range or
+    invalid (e.g. "bytes=5-3"), in which case it is ignored and the whole
+    file is sent. Raises ValueError when the range is valid but cannot be
+    satisfied, i.e. it starts at or past the end of the file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # "bytes=-500" is the last 500 bytes, "bytes=-0" selects nothing
+        if int(last) == 0:
+            raise ValueError("Range not satisfiable")
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def readRange(file, start: int, length: int):
+    # Yield `length` bytes of a file from `start` without loading it whole
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serveMedia(request, path: str):
+    # Serve a file from MEDIA_ROOT with caching headers and byte ranges
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("File not found")
+    if not os.path.isfile(full_path):
+        raise Http404("File not found")
+
+    stat = os.stat(full_path)
+    etag = getETag(path, stat)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": getCacheControl(path),
+        "Last-Modified": http_date(stat.st_mtime),
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in [tag.removeprefix("W/") for tag in parse_etags(if_none_match)]
+    ):
+        response = HttpResponseNotModified()
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+
+    # Let the web server send the file, it also handles the Range header:
+    # "x-sendfile" (Apache, lighttpd) or "x-accel-redirect" (nginx)
+    sendfile = getattr(settings, "MEDIA_SENDFILE", None)
+    if sendfile:
+        response = HttpResponse(content_type=content_type)
+        if sendfile == "x-accel-redirect":
+            # Internal nginx location mapped to MEDIA_ROOT, the URI is decoded by nginx
+            prefix = getattr(
+                settings, "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/"
+            )
+            response["X-Accel-Redirect"] = prefix + quote(path)
+        else:
+            response["X-Sendfile"] = full_path
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    # A Range is ignored when If-Range does not match the current file
+    range_header = request.META.get("HTTP_RANGE")
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range and if_range.strip() != etag:
+        range_header = None
+    try:
+        byte_range = parseRange(range_header, stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+        return response
+
+    if byte_range is None:
+        # FileResponse uses the server's file wrapper (sendfile) when available
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            readRange(open(full_path, "rb"), start, length),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    if encoding:
+        response["Content-Encoding"] = encoding
+    for name, value in headers.items():
+        response[name] = value
+    return response
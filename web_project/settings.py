@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 import cloudinary
 import dj_database_url
 import dotenv
@@ -108,6 +109,37 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The cache versions are the ETags and invalidate the cached responses, so
+# every process must share them. Set CACHE_BACKEND and CACHE_LOCATION to a
+# shared cache (e.g. django.core.cache.backends.redis.RedisCache); the
+# per-process memory cache is only allowed in development
+
+CACHE_BACKEND = os.environ.get(
+    "CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'
+)
+PER_PROCESS_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+if not DEBUG and CACHE_BACKEND in PER_PROCESS_CACHE_BACKENDS:
+    raise ImproperlyConfigured(
+        "CACHE_BACKEND must be a cache shared by every process (e.g. Redis or "
+        "Memcached) when DEBUG is off, got {}".format(CACHE_BACKEND)
+    )
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get("CACHE_LOCATION", 'theledlead'),
+    }
+}
+
+# Seconds a cached book response is kept, it is invalidated earlier on changes
+BOOKS_CACHE_TIMEOUT = int(os.environ.get("BOOKS_CACHE_TIMEOUT", 60 * 60))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -164,6 +196,34 @@ MEDIA_URL = '/media/'
 # Define the absolute filesystem path to the directory that will hold media.
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Read events from the book view are buffered in memory and written in batches
+# once READ_BUFFER_BATCH_SIZE events are pending or the oldest is
+# READ_BUFFER_MAX_AGE seconds old
+READ_BUFFER_BATCH_SIZE = int(os.environ.get("READ_BUFFER_BATCH_SIZE", 100))
+READ_BUFFER_MAX_AGE = float(os.environ.get("READ_BUFFER_MAX_AGE", 5))
+
+# Host the book covers are uploaded to by the upload_cover job, use
+# books.imagehost.LocalImageHost to keep them in MEDIA_ROOT instead of Cloudinary
+BOOKS_IMAGE_HOST = os.environ.get(
+    "BOOKS_IMAGE_HOST", "books.imagehost.CloudinaryImageHost"
+)
+
+# Storage of the uploaded book covers, the default names each file after the
+# SHA-256 of its content so identical covers are stored once
+BOOKS_COVER_STORAGE = os.environ.get(
+    "BOOKS_COVER_STORAGE", "books.storage.ContentAddressedStorage"
+)
+
+# Number of processes resizing book covers into their derivatives
+COVER_IMAGE_WORKERS = int(os.environ.get("COVER_IMAGE_WORKERS", 2))
+
+# Let the web server send media files: "x-sendfile" (Apache, lighttpd) or
+# "x-accel-redirect" (nginx, with an internal location mapped to MEDIA_ROOT)
+MEDIA_SENDFILE = os.environ.get("MEDIA_SENDFILE") or None
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get(
+    "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/"
+)
+
 # Knox Authentication Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': ('knox.auth.TokenAuthentication',),
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from django.test import TestCase, override_settings
+
+
+class ServeMediaTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.data = bytes(range(256)) * 40
+        os.makedirs(os.path.join(self.media_root, "covers"))
+        with open(os.path.join(self.media_root, "covers", "cover.png"), "wb") as file:
+            file.write(self.data)
+        self.digest = hashlib.sha256(self.data).hexdigest()
+        with open(os.path.join(self.media_root, f"{self.digest}.png"), "wb") as file:
+            file.write(self.data)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_serve_file(self):
+        response = self.client.get("/media/covers/cover.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertNotIn("immutable", response["Cache-Control"])
+
+    def test_content_addressed_file_is_immutable(self):
+        response = self.client.get(f"/media/{self.digest}.png")
+        self.assertEqual(response["ETag"], f'"{self.digest}"')
+        self.assertIn("immutable", response["Cache-Control"])
+
+    def test_not_modified(self):
+        etag = self.client.get("/media/covers/cover.png")["ETag"]
+        response = self.client.get("/media/covers/cover.png", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        response = self.client.get("/media/covers/cover.png", HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.data[10:20])
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.data)}")
+
+        response = self.client.get("/media/covers/cover.png", HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(response.streaming_content), self.data[-5:])
+
+        response = self.client.get(
+            "/media/covers/cover.png", HTTP_RANGE=f"bytes={len(self.data)}-"
+        )
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.data)}")
+
+        # An invalid range is ignored rather than refused
+        for header in ("bytes=19-10", "bytes=a-b", "items=0-1"):
+            response = self.client.get("/media/covers/cover.png", HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(b"".join(response.streaming_content), self.data)
+
+        # A stale If-Range gets the whole file
+        response = self.client.get(
+            "/media/covers/cover.png", HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"old"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_outside_media_root(self):
+        response = self.client.get("/media/../settings.py")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/media/covers/missing.png")
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE="x-accel-redirect")
+    def test_sendfile_offload(self):
+        response = self.client.get("/media/covers/cover.png")
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/covers/cover.png")
+        self.assertEqual(response.content, b"")
+
+        # Names are sent URL-encoded
+        with open(os.path.join(self.media_root, "covers", "my cover é.png"), "wb") as file:
+            file.write(self.data)
+        with self.settings(MEDIA_ACCEL_REDIRECT_PREFIX="/internal/"):
+            response = self.client.get("/media/covers/my%20cover%20%C3%A9.png")
+        self.assertEqual(
+            response["X-Accel-Redirect"], "/internal/covers/my%20cover%20%C3%A9.png"
+        )
+        self.assertEqual(response.content, b"")
@@ -16,16 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include, re_path
-from django.conf import settings
-from django.conf.urls.static import static
-from django.views.static import serve
 from knox import views as knox_views
+from .media import serveMedia
 from .views import homeView, signup, login_view as login, logout_view as logout, changePassword
 
 urlpatterns = [
-    re_path(r'^media/(?P<path>.*)$', serve, {
-        'document_root': settings.MEDIA_ROOT,
-    }),
+    re_path(r'^media/(?P<path>.*)$', serveMedia), # Media files with caching and ranges
     path('books/', include('books.urls')), # Books urls
     path('tll-admin/', include('TLLAdmin.urls')), # TLLAdmin urls
     path('', homeView, name="home_view"),
@@ -35,8 +31,4 @@ urlpatterns = [
     path('logout/', knox_views.LogoutView.as_view(), name='logout'),
     path('logoutall/', knox_views.LogoutAllView.as_view(), name='logoutall'),
     path('change-password/', changePassword, name='change_password'),
-]
-
-# Serve media files during development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file